@@ -235,6 +235,7 @@ function performCommonParameterValidation(rawParams) {
 
     // now that everything else is valid, let's add these
     validatedParams.isBinaryKey = getBooleanFromArgs(rawParams, 'isBinaryKey');
+    validatedParams.isParallelPartitions = getBooleanFromArgs(rawParams, 'isParallelPartitions');
     validatedParams.authKey = rawParams.authKey;
     validatedParams.triggerURL = getTriggerURL(rawParams.endpoint, rawParams.triggerName);
 
@@ -247,11 +248,12 @@ function performCommonParameterValidation(rawParams) {
 function performUpdateParameterValidation(params, doc) {
     return new Promise((resolve, reject) => {
 
-        if (params.isBinaryKey !== undefined || params.isBinaryValue !== undefined || params.isJSONData !== undefined) {
+        if (params.isBinaryKey !== undefined || params.isBinaryValue !== undefined || params.isJSONData !== undefined || params.isParallelPartitions !== undefined) {
             var updatedParams = {
                 isJSONData: doc.isJSONData,
                 isBinaryKey: doc.isBinaryKey,
-                isBinaryValue: doc.isBinaryValue
+                isBinaryValue: doc.isBinaryValue,
+                isParallelPartitions: doc.isParallelPartitions
             };
 
             if (params.isJSONData !== undefined) {
@@ -269,10 +271,14 @@ function performUpdateParameterValidation(params, doc) {
             if (params.isBinaryKey !== undefined) {
                 updatedParams.isBinaryKey = getBooleanFromArgs(params, 'isBinaryKey');
             }
+
+            if (params.isParallelPartitions !== undefined) {
+                updatedParams.isParallelPartitions = getBooleanFromArgs(params, 'isParallelPartitions');
+            }
             resolve(updatedParams);
         } else {
             // cannot update any other parameters
-            reject({ validationError: 'At least one of isJsonData, isBinaryKey, or isBinaryValue must be supplied.' });
+            reject({ validationError: 'At least one of isJsonData, isBinaryKey, isBinaryValue, or isParallelPartitions must be supplied.' });
         }
     });
 }
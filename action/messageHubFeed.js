@@ -26,6 +26,7 @@ const common = require('./lib/common');
  *  @param {bool}   isJSONData - attempt to parse messages as JSON
  *  @param {bool}   isBinaryKey - encode key as Base64
  *  @param {bool}   isBinaryValue - encode message as Base64
+ *  @param {bool}   isParallelPartitions - fire each partition of the topic independently
  *  @param {string} endpoint - address to OpenWhisk deployment (expected to be bound at deployment)
  */
 function main(params) {
@@ -29,6 +29,7 @@ var moment = require('moment');
  *  @param {bool}   isJSONData - attempt to parse messages as JSON
  *  @param {bool}   isBinaryKey - encode key as Base64
  *  @param {bool}   isBinaryValue - encode message as Base64
+ *  @param {bool}   isParallelPartitions - fire each partition of the topic independently
  *  @param {string} endpoint - address to OpenWhisk deployment (expected to be bound at deployment)
  *  @param {string} DB_URL - URL for the DB, must include authentication (expected to be bound at deployment)
  *  @param {string} DB_NAME - DB name (expected to be bound at deployment)
@@ -99,6 +100,7 @@ function main(params) {
                             isJSONData: triggerDoc.isJSONData,
                             isBinaryValue: triggerDoc.isBinaryValue,
                             isBinaryKey: triggerDoc.isBinaryKey,
+                            isParallelPartitions: triggerDoc.isParallelPartitions,
                             kafka_brokers_sasl: triggerDoc.brokers,
                             kafka_admin_url: triggerDoc.kafka_admin_url,
                             user: triggerDoc.username,
@@ -21,13 +21,58 @@
 import logging
 import os
 
-from flask import Flask, jsonify
+from consumer import Consumer, statusUpdates
+from consumerspawner import ConsumerSpawner
+
+
+def configureLogging():
+    logLevels = {
+        "info": logging.INFO,
+        "debug": logging.DEBUG,
+        "error": logging.ERROR,
+        "warning": logging.WARNING,
+        "critical": logging.CRITICAL
+    }
+    logger = logging.getLogger()
+    logger.setLevel(logLevels.get(os.getenv('LOG_LEVEL', "info")))
+
+    component = os.getenv('INSTANCE', 'messageHubTrigger-0')
+
+    # Make sure we log to the console
+    streamHandler = logging.StreamHandler()
+    formatter = logging.Formatter('[%(asctime)s.%(msecs)03dZ] [%(levelname)s] [??] [kafkatriggers] %(message)s', datefmt="%Y-%m-%dT%H:%M:%S")
+    streamHandler.setFormatter(formatter)
+    logger.addHandler(streamHandler)
+
+    # also log to file if /logs is present
+    if os.path.isdir('/logs'):
+        fh = logging.FileHandler('/logs/{}_logs.log'.format(component))
+        fh.setFormatter(formatter)
+        logger.addHandler(fh)
+
+
+# The ConsumerSpawner has to be forked before the modules that only the main
+# process needs are imported below, and before any threads are started, so
+# that consumers are forked from an image holding nothing else.
+if __name__ == '__main__':
+    configureLogging()
+
+    if os.getenv('CONSUMER_SPAWNER', 'False') == 'True' and os.getenv('CONSUMER_POOL', 'False') != 'True':
+        logging.info('Forking consumers from a ConsumerSpawner process')
+        Consumer.spawner = ConsumerSpawner()
+        Consumer.spawner.start()
+
+from flask import Flask, Response, jsonify
 from consumercollection import ConsumerCollection
+from consumerpool import ConsumerPool
 from database import Database
 from thedoctor import TheDoctor
-from health import generateHealthReport
+from health import HealthSampler
+from metrics import MetricsSampler, registry
 from gevent.wsgi import WSGIServer
+from multiprocessing import cpu_count
 from service import Service
+from statuswriter import StatusWriter
 
 
 app = Flask(__name__)
@@ -36,6 +81,8 @@ app.debug = False
 database = None
 consumers = ConsumerCollection()
 feedService = None
+healthSampler = None
+metricsSampler = None
 
 
 @app.route('/')
@@ -46,34 +93,15 @@ def testRoute():
 # TODO call TheDoctor.isAlive() and report on that
 @app.route('/health')
 def healthRoute():
-    return jsonify(generateHealthReport(consumers, feedService.lastCanaryTime))
+    return Response(healthSampler.reportJSON, mimetype='application/json')
 
 
-def main():
-    logLevels = {
-        "info": logging.INFO,
-        "debug": logging.DEBUG,
-        "error": logging.ERROR,
-        "warning": logging.WARNING,
-        "critical": logging.CRITICAL
-    }
-    logger = logging.getLogger()
-    logger.setLevel(logLevels.get(os.getenv('LOG_LEVEL', "info")))
+@app.route('/metrics')
+def metricsRoute():
+    return Response(metricsSampler.exposition, mimetype='text/plain; version=0.0.4')
 
-    component = os.getenv('INSTANCE', 'messageHubTrigger-0')
-
-    # Make sure we log to the console
-    streamHandler = logging.StreamHandler()
-    formatter = logging.Formatter('[%(asctime)s.%(msecs)03dZ] [%(levelname)s] [??] [kafkatriggers] %(message)s', datefmt="%Y-%m-%dT%H:%M:%S")
-    streamHandler.setFormatter(formatter)
-    logger.addHandler(streamHandler)
-
-    # also log to file if /logs is present
-    if os.path.isdir('/logs'):
-        fh = logging.FileHandler('/logs/{}_logs.log'.format(component))
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
 
+def main():
     local_dev = os.getenv('LOCAL_DEV', 'False')
     logging.debug('LOCAL_DEV is {} {}'.format(local_dev, type(local_dev)))
     global check_ssl
@@ -86,16 +114,34 @@ def main():
     enable_generic_kafka = (generic_kafka == 'True')
     logging.info('enable_generic_kafka is {} {}'.format(enable_generic_kafka, type(enable_generic_kafka)))
 
+    consumer_pool = os.getenv('CONSUMER_POOL', 'False')
+    logging.debug('CONSUMER_POOL is {} {}'.format(consumer_pool, type(consumer_pool)))
+    if consumer_pool == 'True':
+        pool_size = int(os.getenv('CONSUMER_POOL_SIZE', cpu_count()))
+        logging.info('Running consumers in a pool of {} worker processes'.format(pool_size))
+        Consumer.pool = ConsumerPool(pool_size)
+        Consumer.pool.start()
+
     global database
     database = Database()
     database.migrate()
 
+    StatusWriter(statusUpdates).start()
+
     TheDoctor(consumers).start()
 
     global feedService
     feedService = Service(consumers)
     feedService.start()
 
+    global healthSampler
+    healthSampler = HealthSampler(consumers, feedService, float(os.getenv('HEALTH_SAMPLE_INTERVAL', 5)))
+    healthSampler.start()
+
+    global metricsSampler
+    metricsSampler = MetricsSampler(registry, float(os.getenv('METRICS_SAMPLE_INTERVAL', 5)))
+    metricsSampler.start()
+
     port = int(os.getenv('PORT', 5000))
     server = WSGIServer(('', port), app, log=logging.getLogger())
     server.serve_forever()
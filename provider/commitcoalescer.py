@@ -0,0 +1,148 @@
+"""CommitCoalescer class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import logging
+import time
+
+from confluent_kafka import TopicPartition
+from threading import Lock
+
+
+# Collects the offsets to be committed, keeping only the highest offset for
+# each partition, and commits them all at once. The cost of a commit is
+# therefore proportional to the number of partitions rather than the number
+# of messages.
+class CommitCoalescer:
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self.lastFlush = time.time()
+
+        # (topic, partition) -> the next offset to consume
+        self.offsets = dict()
+
+        # (topic, partition) -> the last offset committed
+        self.committed = dict()
+
+        # (topic, partition) -> the latest offset being committed, until the
+        # commit is known to have succeeded or failed
+        self.inflight = dict()
+
+        # __on_revoke may flush from inside poll() while the owner is adding
+        self.lock = Lock()
+
+    def add(self, messages):
+        with self.lock:
+            for message in messages:
+                key = (message.topic(), message.partition())
+
+                # Add one to the offset, otherwise we'll consume this message again.
+                # That's just how Kafka works, you place the bookmark at the *next* message.
+                offset = message.offset() + 1
+
+                if offset > self.offsets.get(key, -1):
+                    self.offsets[key] = offset
+
+    # asynchronously commit pending offsets if the commit interval has elapsed
+    def flushIfDue(self, consumer):
+        if time.time() - self.lastFlush >= self.interval:
+            try:
+                self.flush(consumer, async=True)
+            except Exception as e:
+                logging.error('[{}] Failed to commit offsets, will retry: {}'.format(self.name, e))
+
+    # If the commit raises, or reports that it failed, the offsets are kept so
+    # that the next flush tries them again. An asynchronous commit is only
+    # known to have succeeded once its delivery report arrives in onCommit.
+    def flush(self, consumer, async):
+        with self.lock:
+            pending = self.offsets
+
+            self.offsets = dict()
+            self.lastFlush = time.time()
+
+            for key, offset in pending.items():
+                self.inflight[key] = offset
+
+        if len(pending) == 0:
+            return
+
+        offsets = [TopicPartition(topic, partition, offset) for (topic, partition), offset in pending.items()]
+
+        try:
+            logging.debug('[{}] Committing offsets for {} partitions'.format(self.name, len(offsets)))
+            committed = consumer.commit(offsets=offsets, async=async)
+        except Exception:
+            with self.lock:
+                for key, offset in pending.items():
+                    self.__failed(key, offset)
+            raise
+
+        if not async:
+            self.__record(committed if committed is not None else offsets)
+
+    # Forgets everything about the partitions, given as (topic, partition),
+    # once they have been revoked. Offsets that have yet to be committed are
+    # dropped, as committing them would overwrite the progress of the
+    # partitions' new owner.
+    def forget(self, partitions):
+        with self.lock:
+            for key in partitions:
+                self.offsets.pop(key, None)
+                self.committed.pop(key, None)
+                self.inflight.pop(key, None)
+
+    # the delivery report for commits
+    def onCommit(self, error, partitions):
+        if error is not None:
+            logging.error('[{}] Failed to commit offsets: {}'.format(self.name, error))
+
+            with self.lock:
+                for partition in partitions:
+                    self.__failed((partition.topic, partition.partition), partition.offset)
+        else:
+            self.__record(partitions)
+
+    def __record(self, partitions):
+        with self.lock:
+            for partition in partitions:
+                key = (partition.topic, partition.partition)
+
+                if partition.error is not None:
+                    logging.error('[{}] Failed to commit offset {} of partition {}: {}'.format(self.name, partition.offset, partition.partition, partition.error))
+                    self.__failed(key, partition.offset)
+                elif key in self.inflight:
+                    if partition.offset > self.committed.get(key, -1):
+                        self.committed[key] = partition.offset
+
+                    if self.inflight[key] <= partition.offset:
+                        del self.inflight[key]
+
+    # Puts back an offset that failed to commit, unless higher ones were added
+    # or committed since, or the partition has been forgotten. Must be called
+    # with the lock held.
+    def __failed(self, key, offset):
+        if self.inflight.get(key) != offset:
+            return
+
+        del self.inflight[key]
+
+        if offset > self.offsets.get(key, -1) and offset > self.committed.get(key, -1):
+            self.offsets[key] = offset
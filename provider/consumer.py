@@ -18,39 +18,284 @@
  */
 """
 
-import json
 import logging
+import metrics
 import os
 import requests
+import resource
 import time
 
 # HEADS UP! I'm importing confluent_kafka.Consumer as KafkaConsumer to avoid a
 # naming conflict with my own Consumer class
 from confluent_kafka import Consumer as KafkaConsumer, KafkaError, TopicPartition
-from database import Database
+from collections import deque
+from commitcoalescer import CommitCoalescer
 from datetime import datetime
 from datetimeutils import secondsSince
-from multiprocessing import Process, Manager
+from eventpipe import EventPipe
+from multiprocessing import Process
+from firepipeline import FirePipeline, FireTask
+from lagtracker import LagTracker
+from messagecodec import newMessageCodec
+from payloadbuilder import PayloadBuilder
+from retryscheduler import RetryScheduler
+from statetable import StateTable
 from urlparse import urlparse
 from authHandler import AuthHandlerException
 from authHandler import IAMAuth
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from requests.packages.urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 
 local_dev = os.getenv('LOCAL_DEV', 'False')
 payload_limit = int(os.getenv('PAYLOAD_LIMIT', 900000))
+consume_batch_size = int(os.getenv('CONSUME_BATCH_SIZE', 1000))
+json_headers = {'Content-Type': 'application/json'}
+fire_pool_size = int(os.getenv('FIRE_POOL_SIZE', 4))
+fire_connect_retries = int(os.getenv('FIRE_CONNECT_RETRIES', 2))
+max_inflight_fires = int(os.getenv('MAX_INFLIGHT_FIRES', 1))
+max_partition_lanes = int(os.getenv('MAX_PARTITION_LANES', 8))
+commit_interval = float(os.getenv('COMMIT_INTERVAL', 1))
+memory_sample_interval = 60
+lag_interval = float(os.getenv('LAG_INTERVAL', 30))
+kafka_stats_interval = int(os.getenv('KAFKA_STATS_INTERVAL', 0))
 check_ssl = (local_dev == 'False')
 seconds_in_day = 86400
 
-processingManager = Manager()
+# Holds the state of every consumer. This must be created before any consumer
+# processes are forked.
+stateTable = StateTable(int(os.getenv('STATE_TABLE_SIZE', 20000)))
 
+# Every ConsumerRunner puts its trigger here once it has recorded its final
+# state and is about to stop, so that TheDoctor can deal with it right away.
+consumerExits = EventPipe()
+
+# Consumers put (triggerFQN, statusCode, dateChanged) here to have their
+# trigger recorded as disabled by the StatusWriter in the main process.
+statusUpdates = EventPipe()
+
+
+# Each ConsumerRunner fires its trigger through its own Session, so that
+# connections to the OpenWhisk API host are kept alive and reused between
+# fires. Failures to connect are retried by the adapter (which is safe since
+# the request was never sent), while all other failures are left to the
+# ConsumerRunner to handle.
+def newFireSession(poolSize=fire_pool_size):
+    retries = Retry(total=fire_connect_retries, connect=fire_connect_retries, read=0, redirect=0, backoff_factor=0.1)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, max_retries=retries)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+# return the total number of connections opened by the session
+def connectionsOpened(session):
+    total = 0
+
+    # the same adapter is mounted for both http:// and https://
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+
+    return total
+
+
+# return the resident and shared memory of a process (by default this one) in
+# bytes, or None if they cannot be read
+def processMemory(pid='self'):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as statm:
+            fields = statm.read().split()
+    except IOError:
+        return None
+
+    pageSize = resource.getpagesize()
+    return int(fields[1]) * pageSize, int(fields[2]) * pageSize
+
+
+# Each Consumer instance will have a slot in the shared state table that will be used to
+# indicate state, and desired state changes between this process, and the ConsumerRunner.
+def newSharedState(spec):
+    sharedState = SharedState(stateTable.allocate())
+    sharedState.reset(spec)
+    return sharedState
+
+
+class SharedState(object):
+    def __init__(self, index):
+        self.index = index
+        self.slot = stateTable.slot(index)
+
+    # Only the slot index is pickled when handing the state to a pooled worker
+    # process. The table itself is inherited from the main process.
+    def __getstate__(self):
+        return (self.index,)
+
+    def __setstate__(self, state):
+        self.__init__(state[0])
+
+    # must only be called while no runner is using the slot
+    def reset(self, spec):
+        stateTable.clear(self.index)
+
+        if not spec.active:
+            self.setCurrentState(Consumer.State.Disabled)
+            self.setDesiredState(Consumer.State.Disabled)
+        else:
+            self.setCurrentState(Consumer.State.Initializing)
+            self.setDesiredState(Consumer.State.Running)
+
+    def currentState(self):
+        return Consumer.State.names[self.slot.currentState]
+
+    def setCurrentState(self, newState):
+        self.slot.currentState = Consumer.State.codes[newState]
+
+    def desiredState(self):
+        return Consumer.State.names[self.slot.desiredState]
+
+    def setDesiredState(self, newState):
+        self.slot.desiredState = Consumer.State.codes[newState]
+
+    def lastPoll(self):
+        if self.slot.lastPoll == 0:
+            return datetime.max
+        else:
+            return datetime.fromtimestamp(self.slot.lastPoll)
+
+    def updateLastPoll(self):
+        self.slot.lastPoll = time.time()
+
+    def recordLoop(self, seconds, idleWait):
+        slot = self.slot
+
+        # exponentially weighted moving average of the loop duration
+        if slot.loopCount == 0:
+            slot.loopSeconds = seconds
+        else:
+            slot.loopSeconds += (seconds - slot.loopSeconds) * 0.1
+
+        slot.loopCount += 1
+        slot.idleWait = idleWait
+
+    def loopStats(self):
+        return {
+            'iterations': self.slot.loopCount,
+            'averageLoopSeconds': self.slot.loopSeconds,
+            'idleWaitSeconds': self.slot.idleWait
+        }
+
+    def recordFire(self, seconds, connections):
+        slot = self.slot
+
+        # exponentially weighted moving average of the fire latency
+        if slot.fireCount == 0:
+            slot.fireSeconds = seconds
+        else:
+            slot.fireSeconds += (seconds - slot.fireSeconds) * 0.1
+
+        slot.fireCount += 1
+        slot.connections = connections
+
+    def fireStats(self):
+        return {
+            'fires': self.slot.fireCount,
+            'averageFireSeconds': self.slot.fireSeconds,
+            'connectionsOpened': self.slot.connections
+        }
+
+    def recordLag(self, messages, seconds):
+        slot = self.slot
+
+        slot.lagMessages = messages
+        slot.lagSeconds = -1 if seconds is None else seconds
+        slot.lagSampled = time.time()
+
+    def lagStats(self):
+        slot = self.slot
+
+        if slot.lagSampled == 0:
+            return None
+
+        return {
+            'messages': slot.lagMessages,
+            'estimatedSeconds': None if slot.lagSeconds < 0 else slot.lagSeconds,
+            'secondsSinceSample': time.time() - slot.lagSampled
+        }
+
+    def recordKafkaStats(self, stats):
+        slot = self.slot
+
+        slot.fetchQueueMessages = stats['fetchQueueMessages']
+        slot.fetchQueueBytes = stats['fetchQueueBytes']
+        slot.brokerRttSeconds = stats['brokerRttSeconds']
+        slot.rebalances = stats['rebalances']
+        slot.rxBytes = stats['rxBytes']
+        slot.txBytes = stats['txBytes']
+        slot.statsSampled = time.time()
+
+    def kafkaStats(self):
+        slot = self.slot
+
+        if slot.statsSampled == 0:
+            return None
+
+        return {
+            'fetchQueueMessages': slot.fetchQueueMessages,
+            'fetchQueueBytes': slot.fetchQueueBytes,
+            'brokerRttSeconds': slot.brokerRttSeconds,
+            'rebalances': slot.rebalances,
+            'rxBytes': slot.rxBytes,
+            'txBytes': slot.txBytes,
+            'secondsSinceSample': time.time() - slot.statsSampled
+        }
+
+    def recordSpawn(self, seconds):
+        self.slot.spawnSeconds = seconds
+
+    def recordMemory(self, rssBytes, sharedBytes):
+        self.slot.rssBytes = rssBytes
+        self.slot.sharedBytes = sharedBytes
+
+    def recordWorker(self, index):
+        self.slot.worker = index + 1
+
+    # index of the ConsumerPool worker hosting the consumer, or None if the
+    # consumer has a process of its own
+    def worker(self):
+        return self.slot.worker - 1 if self.slot.worker > 0 else None
+
+    def processStats(self):
+        worker = self.worker()
+
+        if worker is not None:
+            # the worker's memory is shared by all of its consumers, and is
+            # reported once for each worker by ConsumerPool.stats()
+            return {
+                'worker': worker
+            }
+
+        return {
+            'spawnSeconds': self.slot.spawnSeconds,
+            'rssBytes': self.slot.rssBytes,
+            'sharedBytes': self.slot.sharedBytes
+        }
+
+    def secondsSinceLastPoll(self):
+        lastPoll = self.slot.lastPoll
+
+        if lastPoll == 0:
+            return secondsSince(datetime.max)
+        else:
+            return time.time() - lastPoll
 
-# Each Consumer instance will have a shared dictionary that will be used to
-# indicate state, and desired state changes between this process, and the ConsumerProcess.
-def newSharedDictionary():
-    sharedDictionary = processingManager.dict()
-    sharedDictionary['lastPoll'] = datetime.max
-    return sharedDictionary
 
 class Consumer:
     class State:
@@ -61,168 +306,312 @@ class Consumer:
         Dead = 'Dead'
         Disabled = 'Disabled'
 
-    def __init__(self, trigger, params):
-        self.trigger = trigger
-        self.params = params
+        # compact encoding of the states for the shared state table
+        names = [Initializing, Running, Stopping, Restart, Dead, Disabled]
+        codes = dict((name, code) for code, name in enumerate(names))
+
+    # ConsumerPool shared by all consumers when running in pooled mode, or the
+    # ConsumerSpawner that forks their processes. When both are None, each
+    # consumer runs in its own ConsumerProcess forked from this process.
+    pool = None
+    spawner = None
 
-        self.sharedDictionary = newSharedDictionary()
+    # how long to wait for a consumer to stop when restarting it
+    restart_timeout_seconds = 30
 
-        self.process = ConsumerProcess(trigger, params, self.sharedDictionary)
+    def __init__(self, spec):
+        self.trigger = spec.trigger
+        self.spec = spec
+
+        self.sharedState = newSharedState(spec)
+
+        # only created once the consumer is started
+        self.process = None
         self.__restartCount = 0
         self.__lastRestart = datetime.now()
 
     def currentState(self):
-        return self.sharedDictionary['currentState']
+        return self.sharedState.currentState()
 
     def desiredState(self):
-        return self.sharedDictionary['desiredState']
+        return self.sharedState.desiredState()
 
     def setDesiredState(self, newState):
-        self.sharedDictionary['desiredState'] = newState
+        self.sharedState.setDesiredState(newState)
 
     def shutdown(self):
-        if self.currentState() == Consumer.State.Disabled:
-            self.sharedDictionary['currentState'] = Consumer.State.Dead
+        # with no runner left to report the exit, tell the Doctor directly so
+        # that it does not wait for the consumer's next deadline
+        if self.currentState() == Consumer.State.Disabled or (self.process is not None and not self.process.is_alive()):
+            self.sharedState.setCurrentState(Consumer.State.Dead)
             self.setDesiredState(Consumer.State.Dead)
+            consumerExits.put(self.trigger)
         else:
-            self.sharedDictionary['currentState'] = Consumer.State.Stopping
+            self.sharedState.setCurrentState(Consumer.State.Stopping)
             self.setDesiredState(Consumer.State.Dead)
 
     def disable(self):
         self.setDesiredState(Consumer.State.Disabled)
 
     def start(self):
+        self.process = self.__newProcess()
         self.process.start()
 
-    # should only be called by the Doctor thread
+    def isProcessAlive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def joinProcess(self, timeout):
+        if self.process is not None:
+            self.process.join(timeout)
+
+    def terminateProcess(self):
+        if self.process is not None and hasattr(self.process, 'terminate'):
+            self.process.terminate()
+
+    # For a consumer that will never be started, record the state its runner
+    # would have recorded on the way out, so that the Doctor can deal with it.
+    def abandon(self):
+        self.sharedState.setCurrentState(self.desiredState())
+        consumerExits.put(self.trigger)
+
+    # Should only be called by the Doctor's ConsumerRestarter. Returns False if
+    # the consumer did not stop within restart_timeout_seconds, in which case
+    # it is left to stop and restart should be called again later.
     def restart(self):
-        if self.desiredState() == Consumer.State.Dead:
-            logging.info('[{}] Request to restart a consumer that is already slated for deletion.'.format(self.trigger))
-            return
+        if self.desiredState() not in (Consumer.State.Running, Consumer.State.Restart):
+            logging.info('[{}] Not restarting consumer, its desired state is {}'.format(self.trigger, self.desiredState()))
+            return True
 
-        timeBetweenRestarts = datetime.now() - self.__lastRestart
-        self.__lastRestart = datetime.now()
+        if self.desiredState() != Consumer.State.Restart:
+            timeBetweenRestarts = datetime.now() - self.__lastRestart
+            self.__lastRestart = datetime.now()
 
-        if timeBetweenRestarts.total_seconds() >= seconds_in_day:
-            self.__restartCount = 1
-        else:
-            self.__restartCount += 1
+            if timeBetweenRestarts.total_seconds() >= seconds_in_day:
+                self.__restartCount = 1
+            else:
+                self.__restartCount += 1
+
+            metrics.restarts.inc()
+
+            logging.info('[{}] Quietly shutting down consumer for restart'.format(self.trigger))
+            self.setDesiredState(Consumer.State.Restart)
+
+        self.joinProcess(self.restart_timeout_seconds)
+
+        if self.isProcessAlive():
+            if hasattr(self.process, 'terminate'):
+                logging.warn('[{}] Consumer did not shut down in time. Terminating its process.'.format(self.trigger))
+                self.process.terminate()
+                self.process.join(1)
+
+            if self.isProcessAlive():
+                logging.warn('[{}] Consumer has not shut down yet'.format(self.trigger))
+                return False
 
-        logging.info('[{}] Quietly shutting down consumer for restart'.format(self.trigger))
-        self.setDesiredState(Consumer.State.Restart)
-        self.process.join()
         logging.info('Consumer has shut down')
 
-        # user may have interleaved a request to delete the trigger, check again
-        if self.desiredState() != Consumer.State.Dead:
+        # user may have interleaved a request to delete or disable the trigger, check again
+        if self.desiredState() == Consumer.State.Restart:
             logging.info('[{}] Starting new consumer thread'.format(self.trigger))
-            self.sharedDictionary = newSharedDictionary()
-            self.process = ConsumerProcess(self.trigger, self.params, self.sharedDictionary)
-            self.process.start()
+            self.sharedState.reset(self.spec)
+            self.start()
+
+        return True
+
+    def __newProcess(self):
+        if Consumer.pool is not None:
+            return Consumer.pool.newProcess(self.spec, self.sharedState)
+        elif Consumer.spawner is not None:
+            return Consumer.spawner.newProcess(self.spec, self.sharedState)
+        else:
+            return ConsumerProcess(self.spec, self.sharedState)
 
     def restartCount(self):
         return self.__restartCount
 
     def lastPoll(self):
-        return self.sharedDictionary['lastPoll']
+        return self.sharedState.lastPoll()
 
     def secondsSinceLastPoll(self):
-        return secondsSince(self.lastPoll())
+        return self.sharedState.secondsSinceLastPoll()
 
+    def loopStats(self):
+        return self.sharedState.loopStats()
 
-class ConsumerProcess (Process):
-    max_retries = 6    # Maximum number of times to retry firing trigger
+    def fireStats(self):
+        return self.sharedState.fireStats()
+
+    def lagStats(self):
+        return self.sharedState.lagStats()
+
+    def kafkaStats(self):
+        return self.sharedState.kafkaStats()
+
+    def processStats(self):
+        return self.sharedState.processStats()
+
+    # give up the slot in the state table once the consumer is no longer tracked
+    def releaseState(self):
+        metrics.registry.retire(self.sharedState.index)
+        stateTable.release(self.sharedState.index)
+
+
+# Decides how long a ConsumerRunner should wait for new messages. Runners loop
+# without waiting while there is a backlog, and back off progressively while
+# their topic stays idle.
+class LoopScheduler:
+    min_idle_wait_seconds = 0.1
+    max_idle_wait_seconds = 5.0
+
+    def __init__(self):
+        self.wait = self.min_idle_wait_seconds
+
+    def record(self, messageCount, hasBacklog):
+        if hasBacklog:
+            self.wait = 0
+        elif messageCount > 0:
+            self.wait = self.min_idle_wait_seconds
+        else:
+            self.wait = min(max(self.wait * 2, self.min_idle_wait_seconds), self.max_idle_wait_seconds)
 
-    def __init__(self, trigger, params, sharedDictionary):
+
+# The messages of a single partition that have been polled but not yet fired,
+# along with the batch currently being fired for that partition, if any. Only
+# one batch per partition is ever in flight, so messages from the same
+# partition are fired and committed in order.
+class PartitionLane:
+    def __init__(self, topic, partition):
+        self.topicPartition = TopicPartition(topic, partition)
+        self.pending = deque()    # (message, encodedMessage) tuples
+        self.task = None
+        self.paused = False
+        self.assigned = True
+        self.lastDispatch = 0
+
+        # the batch in flight was dispatched before the partition was revoked,
+        # so its offsets now belong to another member of the group
+        self.taskRevoked = False
+
+        # a batch from this partition was abandoned, so nothing more from it
+        # may be committed
+        self.abandoned = False
+
+    # whether the batch in flight failed, and is waiting to be retried
+    def isRetrying(self):
+        return self.task is not None and self.task.result == FireTask.Failed
+
+
+# Runs a single ConsumerRunner in a dedicated OS process
+class ConsumerProcess (Process):
+    def __init__(self, spec, sharedState):
         Process.__init__(self)
 
         self.daemon = True
+        self.spec = spec
+        self.sharedState = sharedState
 
-        self.trigger = trigger
-        self.isMessageHub = params["isMessageHub"]
-        self.triggerURL = self.__triggerURL(params["triggerURL"])
-        self.brokers = params["brokers"]
-        self.topic = params["topic"]
+    def start(self):
+        self.requested = time.time()
+        Process.start(self)
 
-        self.sharedDictionary = sharedDictionary
+    def run(self):
+        self.sharedState.recordSpawn(time.time() - self.requested)
+        metrics.spawnSeconds.observe(time.time() - self.requested, slot=self.sharedState.index)
+        ConsumerRunner(self.spec, self.sharedState).run()
 
-        if 'status' in params and params['status']['active'] == False:
-            self.sharedDictionary['currentState'] = Consumer.State.Disabled
-            self.sharedDictionary['desiredState'] = Consumer.State.Disabled
-        else:
-            self.sharedDictionary['currentState'] = Consumer.State.Initializing
-            self.sharedDictionary['desiredState'] = Consumer.State.Running
+
+# Polls a topic and fires the trigger. A runner is hosted either by its own
+# ConsumerProcess, or by a thread in one of the ConsumerPool worker processes.
+class ConsumerRunner:
+    max_retries = 6    # Maximum number of times to retry firing trigger
+
+    def __init__(self, spec, sharedState):
+        self.trigger = spec.trigger
+        self.isMessageHub = spec.isMessageHub
+        self.triggerURL = self.__triggerURL(spec.triggerURL)
+        self.brokers = spec.brokers
+        self.topic = spec.topic
+
+        self.sharedState = sharedState
 
         if self.isMessageHub:
-            self.username = params["username"]
-            self.password = params["password"]
+            self.username = spec.username
+            self.password = spec.password
 
-        if 'isIamKey' in params and params['isIamKey'] == True:
-            self.authHandler = IAMAuth(params['authKey'], params['iamUrl'])
+        if spec.isIamKey:
+            self.authHandler = IAMAuth(spec.authKey, spec.iamUrl)
         else:
-            if 'authKey' in params:
-                auth = params['authKey'].split(':')
+            if spec.authKey is not None:
+                auth = spec.authKey.split(':')
                 self.authHandler = HTTPBasicAuth(auth[0], auth[1])
             else:
-                parsedUrl = urlparse(params["triggerURL"])
+                parsedUrl = urlparse(spec.triggerURL)
                 self.authHandler = HTTPBasicAuth(parsedUrl.username, parsedUrl.password)
 
-        # handle the case where there may be existing triggers that do not
-        # have the isJSONData field set
-        if "isJSONData" in params:
-            self.encodeValueAsJSON = params["isJSONData"]
-        else:
-            self.encodeValueAsJSON = False
+        self.codec = newMessageCodec(spec)
 
-        if "isBinaryValue" in params:
-            self.encodeValueAsBase64 = params["isBinaryValue"]
+        # (topic, partition) -> PartitionLane, or None when every partition is
+        # fired through the same batch
+        if spec.isParallelPartitions:
+            self.lanes = dict()
         else:
-            self.encodeValueAsBase64 = False
-
-        if "isBinaryKey" in params:
-            self.encodeKeyAsBase64 = params["isBinaryKey"]
-        else:
-            self.encodeKeyAsBase64 = False
+            self.lanes = None
 
         # always init consumer to None in case the consumer needs to shut down
         # before the KafkaConsumer is fully initialized/assigned
         self.consumer = None
-
-        # potentially squirrel away the message that would overflow the payload
-        self.queuedMessage = None
+        self.session = None
+        self.pipeline = None
+
+        # batches that have been dispatched but not yet committed, in order
+        self.outstanding = deque()
+        self.retries = RetryScheduler()
+        self.paused = None
+        self.abandoned = False
+        self.stopping = False
+        self.commits = CommitCoalescer(self.trigger, commit_interval)
+        self.lag = LagTracker(self.trigger, lag_interval, self.sharedState)
+
+        # potentially squirrel away the messages that would overflow the payload,
+        # as (message, encodedMessage) tuples
+        self.queuedMessages = []
+        self.overflow = None
+
+        self.scheduler = LoopScheduler()
+        self.lastMemorySample = 0
 
     # this only records the current state, and does not affect a state transition
     def __recordState(self, newState):
-        self.sharedDictionary['currentState'] = newState
+        self.sharedState.setCurrentState(newState)
 
     def currentState(self):
-        return self.sharedDictionary['currentState']
+        return self.sharedState.currentState()
 
     def setDesiredState(self, newState):
         logging.info('[{}] Request to set desiredState to {}'.format(self.trigger, newState))
 
-        if self.sharedDictionary['desiredState'] == Consumer.State.Dead and newState != Consumer.State.Dead:
+        if self.desiredState() == Consumer.State.Dead and newState != Consumer.State.Dead:
             logging.info('[{}] Asking to kill a consumer that is already marked for death. Doing nothing.'.format(self.trigger))
             return
         else:
             logging.info('[{}] Setting desiredState to: {}'.format(self.trigger, newState))
-            self.sharedDictionary['desiredState'] = newState
+            self.sharedState.setDesiredState(newState)
 
     def desiredState(self):
-        return self.sharedDictionary['desiredState']
+        return self.sharedState.desiredState()
 
     # convenience method for checking if desiredState is Running
     def __shouldRun(self):
         return self.desiredState() == Consumer.State.Running
 
     def lastPoll(self):
-        return self.sharedDictionary['lastPoll']
+        return self.sharedState.lastPoll()
 
     def updateLastPoll(self):
-        self.sharedDictionary['lastPoll'] = datetime.now()
+        self.sharedState.updateLastPoll()
 
     def secondsSinceLastPoll(self):
-        return secondsSince(self.lastPoll())
+        return self.sharedState.secondsSinceLastPoll()
 
     def __triggerURL(self, originalURL):
         parsed = urlparse(originalURL)
@@ -251,17 +640,57 @@ class ConsumerProcess (Process):
 
     def run(self):
         try:
+            if self.lanes is not None:
+                self.session = newFireSession(max(fire_pool_size, max_partition_lanes))
+                self.pipeline = FirePipeline(self.trigger, max_partition_lanes, self.__fireTrigger)
+            else:
+                # with fewer connections than batches in flight, the extra
+                # fires would each open a connection only to discard it
+                self.session = newFireSession(max(fire_pool_size, max_inflight_fires))
+
+                if max_inflight_fires > 1:
+                    self.pipeline = FirePipeline(self.trigger, max_inflight_fires, self.__fireTrigger)
+
             self.consumer = self.__createConsumer()
 
             while self.__shouldRun():
-                messages = self.__pollForMessages()
+                loopStart = time.time()
+                messageCount = 0
 
-                if len(messages) > 0:
-                    self.__fireTrigger(messages)
+                self.__completeFires()
 
-                time.sleep(0.1)
+                for task in self.retries.due():
+                    if self.__dropRevokedMessages(task):
+                        self.__fire(task)
+
+                if self.lanes is not None:
+                    messageCount = self.__pollIntoLanes()
+                    self.__dispatchLanes()
+                    hasBacklog = self.__lanesHaveBacklog()
+                else:
+                    if len(self.retries) > 0:
+                        self.__pollWhilePaused()
+                    elif len(self.outstanding) >= max_inflight_fires:
+                        self.__completeFires(timeout=1.0)
+                    else:
+                        batch = self.__pollForMessages()
+                        messageCount = len(batch)
+
+                        if messageCount > 0:
+                            self.__observeBatch(batch)
+                            self.__fire(self.__newTask(batch.messages, batch.body()))
+
+                    hasBacklog = len(self.queuedMessages) > 0 or self.overflow is not None
+
+                self.commits.flushIfDue(self.consumer)
+                self.lag.sampleIfDue(self.consumer, self.commits)
+                self.__sampleMemoryIfDue()
+
+                self.scheduler.record(messageCount, hasBacklog)
+                self.sharedState.recordLoop(time.time() - loopStart, self.scheduler.wait)
 
             logging.info("[{}] Consumer exiting main loop".format(self.trigger))
+            self.__abandonFires()
         except Exception as e:
             logging.error('[{}] Uncaught exception: {}'.format(self.trigger, e))
 
@@ -279,6 +708,7 @@ class ConsumerProcess (Process):
         try:
             if self.consumer is not None:
                 logging.info('[{}] Cleaning up consumer'.format(self.trigger))
+                self.commits.flush(self.consumer, async=False)
                 logging.debug('[{}] Closing KafkaConsumer'.format(self.trigger))
                 self.consumer.unsubscribe()
                 self.consumer.close()
@@ -290,8 +720,17 @@ class ConsumerProcess (Process):
         except Exception as e:
             logging.error('[{}] Uncaught exception while shutting down consumer: {}'.format(self.trigger, e))
         finally:
+            if self.pipeline is not None:
+                self.pipeline.stop()
+                self.pipeline = None
+
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
             logging.info('[{}] Recording consumer as {}. Bye bye!'.format(self.trigger, self.desiredState()))
             self.__recordState(self.desiredState())
+            consumerExits.put(self.trigger)
 
     def __createConsumer(self):
         if self.__shouldRun():
@@ -300,9 +739,15 @@ class ConsumerProcess (Process):
                         'default.topic.config': {'auto.offset.reset': 'latest'},
                         'enable.auto.commit': False,
                         'api.version.request': True,
-                        'isolation.level': 'read_uncommitted'
+                        'isolation.level': 'read_uncommitted',
+                        'on_commit': self.commits.onCommit
                     }
 
+            if kafka_stats_interval > 0:
+                config.update({'statistics.interval.ms': kafka_stats_interval,
+                                'stats_cb': self.__onStats
+                             })
+
             if self.isMessageHub:
                 # append Message Hub specific config
                 config.update({'ssl.ca.location': '/etc/ssl/certs/',
@@ -318,56 +763,86 @@ class ConsumerProcess (Process):
             return consumer
 
     def __pollForMessages(self):
-        messages = []
-        totalPayloadSize = 0
+        batch = PayloadBuilder(payload_limit)
         batchMessages = True
 
         if self.__shouldRun():
+            if self.overflow is not None:
+                logging.debug('[{}] Handling message left over from last batch.'.format(self.trigger))
+                message, encodedMessage = self.overflow
+                self.overflow = None
+                batchMessages = self.__addToBatch(batch, message, encodedMessage)
+
             while batchMessages and (self.secondsSinceLastPoll() < 2):
-                if self.queuedMessage != None:
-                    logging.debug('[{}] Handling message left over from last batch.'.format(self.trigger))
-                    message = self.queuedMessage
-                    self.queuedMessage = None
+                if len(self.queuedMessages) > 0:
+                    logging.debug('[{}] Handling {} messages left over from last batch.'.format(self.trigger, len(self.queuedMessages)))
+                    candidates = self.queuedMessages
+                    self.queuedMessages = []
+                elif len(batch) == 0 and self.scheduler.wait > 0:
+                    # Nothing was waiting for us last time around. Block until
+                    # a message arrives (or the wait elapses) rather than
+                    # spinning, then drain whatever else has been fetched.
+                    message = self.consumer.poll(self.scheduler.wait)
+
+                    if message is None:
+                        logging.debug('[{}] message was None. Stopping batch op.'.format(self.trigger))
+                        candidates = []
+                        batchMessages = False
+                    else:
+                        candidates = self.__encode([message])
                 else:
-                    message = self.consumer.poll(1.0)
+                    messages = self.consumer.consume(consume_batch_size, 0)
+                    candidates = self.__encode(messages)
+
+                    # a short batch means that we have caught up with the topic
+                    if len(messages) < consume_batch_size:
+                        logging.debug('[{}] Consumed a partial batch of {} messages. Stopping batch op.'.format(self.trigger, len(messages)))
+                        batchMessages = False
 
                 if self.secondsSinceLastPoll() < 0:
                     logging.info('[{}] Completed first poll'.format(self.trigger))
 
-                if (message is not None):
+                for index, (message, encodedMessage) in enumerate(candidates):
                     if not message.error():
-                        logging.debug("Consumed message: {}".format(str(message)))
-                        messageSize = self.__sizeMessage(message)
-                        if totalPayloadSize + messageSize > payload_limit:
-                            if len(messages) == 0:
-                                logging.error('[{}] Single message at offset {} exceeds payload size limit. Skipping this message!'.format(self.trigger, message.offset()))
-                                self.consumer.commit(message=message, async=False)
-                            else:
-                                logging.debug('[{}] Message at offset {} would cause payload to exceed the size limit. Queueing up for the next round...'.format(self.trigger, message.offset()))
-                                self.queuedMessage = message
-
-                            # in any case, we need to stop batching now
+                        if not self.__addToBatch(batch, message, encodedMessage):
+                            self.queuedMessages = candidates[index + 1:]
                             batchMessages = False
-                        else:
-                            totalPayloadSize += messageSize
-                            messages.append(message)
+                            break
                     elif message.error().code() != KafkaError._PARTITION_EOF:
                         logging.error('[{}] Error polling: {}'.format(self.trigger, message.error()))
+                        self.queuedMessages = candidates[index + 1:]
                         batchMessages = False
+                        break
                     else:
-                        logging.debug('[{}] No more messages. Stopping batch op.'.format(self.trigger))
-                        batchMessages = False
-                else:
-                    logging.debug('[{}] message was None. Stopping batch op.'.format(self.trigger))
-                    batchMessages = False
+                        logging.debug('[{}] Reached the end of partition {}.'.format(self.trigger, message.partition()))
 
         logging.debug('[{}] Completed poll'.format(self.trigger))
 
-        if len(messages) > 0:
-            logging.info("[{}] Found {} messages with a total size of {} bytes".format(self.trigger, len(messages), totalPayloadSize))
+        if len(batch) > 0:
+            logging.info("[{}] Found {} messages with a total size of {} bytes".format(self.trigger, len(batch), batch.size))
 
         self.updateLastPoll()
-        return messages
+        return batch
+
+    # returns False when no more messages should be added to the batch
+    def __addToBatch(self, batch, message, encodedMessage):
+        if batch.add(message, encodedMessage):
+            return True
+
+        if len(batch) == 0:
+            logging.error('[{}] Single message at offset {} exceeds payload size limit. Skipping this message!'.format(self.trigger, message.offset()))
+
+            metrics.skippedMessages.inc(slot=self.sharedState.index)
+
+            # committed in order with the batches that are still outstanding
+            task = self.__newTask([message])
+            task.result = FireTask.Skipped
+            self.__commitCompleted()
+        else:
+            logging.debug('[{}] Message at offset {} would cause payload to exceed the size limit. Queueing up for the next round...'.format(self.trigger, message.offset()))
+            self.overflow = (message, encodedMessage)
+
+        return False
 
     # decide whether or not to disable a trigger based on the status code returned
     # from firing the trigger. Specifically, disable on all 4xx status codes
@@ -375,83 +850,363 @@ class ConsumerProcess (Process):
     def __shouldDisable(self, status_code):
         return status_code in range(400, 500) and status_code not in [408, 409, 429]
 
-    def __fireTrigger(self, messages):
+    # Every batch that has been dispatched, but whose offsets have not yet been
+    # committed, is kept in self.outstanding in the order it was polled. Offsets
+    # are only committed from the head of this queue, so they are always
+    # committed in order no matter in which order the fires complete.
+    def __newTask(self, messages, body=None):
+        task = FireTask(messages, body)
+        self.outstanding.append(task)
+        return task
+
+    def __fire(self, task):
+        if self.pipeline is None:
+            task.result = self.__fireTrigger(task)
+            self.__handleAttempt(task)
+            self.__commitCompleted()
+        else:
+            self.pipeline.submit(task)
+
+    # Drops the messages of revoked partitions from a task that is due to be
+    # retried. Returns False, having completed the task, if none are left.
+    def __dropRevokedMessages(self, task):
+        messages = task.messagesToCommit()
+
+        if len(messages) == len(task.messages):
+            return True
+
+        if len(messages) == 0:
+            task.result = FireTask.Revoked
+
+            if self.lanes is not None:
+                self.__completeLaneTask(task)
+
+            self.__commitCompleted()
+            return False
+
+        # a subset of the batch always fits within the payload limit
+        batch = PayloadBuilder(payload_limit)
+        for message, encodedMessage in zip(messages, self.codec.encodeBatch(messages)):
+            batch.add(message, encodedMessage)
+
+        task.messages = batch.messages
+        task.body = batch.body()
+        return True
+
+    def __completeFires(self, timeout=0):
+        if self.pipeline is not None:
+            for task in self.pipeline.completed(timeout):
+                self.__handleAttempt(task)
+
+                if self.lanes is not None:
+                    self.__completeLaneTask(task)
+
+            self.__commitCompleted()
+
+    def __observeBatch(self, batch):
+        metrics.batchMessages.observe(len(batch), slot=self.sharedState.index)
+        metrics.batchBytes.observe(batch.size, slot=self.sharedState.index)
+
+    def __handleAttempt(self, task):
+        if task.result == FireTask.Fired:
+            metrics.pollToFireSeconds.observe(time.time() - task.polled, slot=self.sharedState.index)
+        elif task.result == FireTask.Failed:
+            if self.stopping or not self.__shouldRun():
+                task.result = FireTask.Abandoned
+            elif task.attempts <= self.max_retries:
+                delay = self.retries.schedule(task)
+                metrics.fireRetries.inc(slot=self.sharedState.index)
+                logging.info("[{}] Retrying in {:.1f} second(s)".format(self.trigger, delay))
+
+                # with partition lanes, only the partition of this batch is paused
+                if self.lanes is None:
+                    self.__pause()
+            else:
+                lastMessage = task.messages[-1]
+                logging.warn("[{}] Skipping {} messages to offset {} of partition {}".format(self.trigger, len(task.messages), lastMessage.offset(), lastMessage.partition()))
+                metrics.skippedMessages.inc(len(task.messages), slot=self.sharedState.index)
+                task.result = FireTask.Skipped
+
+    def __commitCompleted(self):
+        while len(self.outstanding) > 0 and self.outstanding[0].isComplete():
+            task = self.outstanding.popleft()
+
+            if task.result == FireTask.Abandoned:
+                # committing any later batch would also skip past the messages
+                # of this one, so leave all of them to be consumed again
+                self.abandoned = True
+            elif task.shouldCommit() and not self.abandoned:
+                self.commits.add(task.messagesToCommit())
+
+        if self.paused is not None and len(self.retries) == 0:
+            self.__resume()
+
+    # give up on scheduled retries, and wait for in-flight fires to complete
+    def __abandonFires(self):
+        self.stopping = True
+
+        for task in self.retries.clear():
+            task.result = FireTask.Abandoned
+
+            if self.lanes is not None:
+                self.__completeLaneTask(task)
+
+        if self.pipeline is not None:
+            inFlight = self.__inFlightTasks()
+
+            if len(inFlight) > 0:
+                logging.info('[{}] Waiting for {} in-flight fires to complete'.format(self.trigger, len(inFlight)))
+
+            while len(self.__inFlightTasks()) > 0:
+                self.__completeFires(timeout=1.0)
+
+        self.__commitCompleted()
+
+    def __sampleMemoryIfDue(self):
+        # a pooled worker's memory is sampled by the ConsumerPool instead
+        if self.sharedState.worker() is not None:
+            return
+
+        if time.time() - self.lastMemorySample >= memory_sample_interval:
+            self.lastMemorySample = time.time()
+            memory = processMemory()
+
+            if memory is not None:
+                self.sharedState.recordMemory(*memory)
+
+    def __inFlightTasks(self):
+        tasks = [task for task in self.outstanding if not task.isComplete()]
+
+        if self.lanes is not None:
+            tasks.extend([lane.task for lane in self.lanes.values() if lane.task is not None])
+
+        return tasks
+
+    # Polls whatever messages are available without blocking the lanes that
+    # have work to do, and sorts them into the lane of their partition.
+    # Returns the number of messages polled.
+    def __pollIntoLanes(self):
+        messageCount = 0
+
         if self.__shouldRun():
-            lastMessage = messages[len(messages) - 1]
-
-            # I'm sure there is a much more clever way to do this ;)
-            mappedMessages = []
-            for message in messages:
-                mappedMessages.append(self.__getMessagePayload(message))
-
-            payload = {}
-            payload['messages'] = mappedMessages
-            retry = True
-            retry_count = 0
-
-            logging.info("[{}] Firing trigger with {} messages".format(self.trigger,len(mappedMessages)))
-
-            while retry:
-                try:
-                    response = requests.post(self.triggerURL, json=payload, auth=self.authHandler, timeout=10.0, verify=check_ssl)
-                    status_code = response.status_code
-                    logging.info("[{}] Response status code {}".format(self.trigger, status_code))
-
-                    # Manually commit offset if the trigger was fired successfully. Retry firing the trigger
-                    # for a select set of status codes
-                    if status_code in range(200, 300):
-                        if status_code == 204:
-                            logging.info("[{}] Successfully fired trigger".format(self.trigger))
-                        else:
-                            response_json = response.json()
-                            if 'activationId' in response_json and response_json['activationId'] is not None:
-                                logging.info("[{}] Fired trigger with activation {}".format(self.trigger, response_json['activationId']))
-                            else:
-                                logging.info("[{}] Successfully fired trigger".format(self.trigger))
-                        # the consumer may have consumed messages that did not make it into the messages array.
-                        # the consumer may have consumed messages that did not make it into the messages array.
-                        # be sure to only commit to the messages that were actually fired.
-                        self.consumer.commit(offsets=self.__getOffsetList(messages), async=False)
-                        retry = False
-                    elif self.__shouldDisable(status_code):
-                        retry = False
-                        logging.error('[{}] Error talking to OpenWhisk, status code {}'.format(self.trigger, status_code))
-                        self.__dumpRequestResponse(response)
-                        self.__disableTrigger(status_code)
-                except requests.exceptions.RequestException as e:
-                    logging.error('[{}] Error talking to OpenWhisk: {}'.format(self.trigger, e))
-                except AuthHandlerException as e:
-                    logging.error("[{}] Encountered an exception from auth handler, status code {}").format(self.trigger, e.response.status_code)
-                    self.__dumpRequestResponse(e.response)
-
-                    if self.__shouldDisable(e.response.status_code):
-                        retry = False
-                        self.__disableTrigger(e.response.status_code)
-
-                if retry:
-                    retry_count += 1
-
-                    if retry_count <= self.max_retries:
-                        sleepyTime = pow(2,retry_count)
-                        logging.info("[{}] Retrying in {} second(s)".format(self.trigger, sleepyTime))
-                        time.sleep(sleepyTime)
+            # don't sit in poll() while there are lanes waiting to be fired,
+            # or fires waiting to be completed
+            wait = self.scheduler.wait
+            if self.__lanesHaveBacklog():
+                wait = 0
+            elif len(self.__inFlightTasks()) > 0:
+                wait = min(wait, LoopScheduler.min_idle_wait_seconds)
+
+            if wait > 0:
+                message = self.consumer.poll(wait)
+                candidates = [] if message is None else [message]
+            else:
+                candidates = self.consumer.consume(consume_batch_size, 0)
+
+            if len(candidates) == 1:
+                candidates.extend(self.consumer.consume(consume_batch_size - 1, 0))
+
+            if self.secondsSinceLastPoll() < 0:
+                logging.info('[{}] Completed first poll'.format(self.trigger))
+
+            for message, encodedMessage in self.__encode(candidates):
+                if not message.error():
+                    self.__laneFor(message).pending.append((message, encodedMessage))
+                    messageCount += 1
+                elif message.error().code() != KafkaError._PARTITION_EOF:
+                    logging.error('[{}] Error polling: {}'.format(self.trigger, message.error()))
+                else:
+                    logging.debug('[{}] Reached the end of partition {}.'.format(self.trigger, message.partition()))
+
+            if messageCount > 0:
+                logging.debug('[{}] Polled {} messages'.format(self.trigger, messageCount))
+
+            for lane in self.lanes.values():
+                self.__updateLanePause(lane)
+
+        self.updateLastPoll()
+        return messageCount
+
+    def __laneFor(self, message):
+        key = (message.topic(), message.partition())
+        lane = self.lanes.get(key)
+
+        if lane is None:
+            lane = PartitionLane(message.topic(), message.partition())
+            self.lanes[key] = lane
+
+        lane.assigned = True
+        return lane
+
+    # Fires a batch from each idle lane that has pending messages, starting with
+    # the lanes that have waited the longest, for as long as there is room
+    # under max_partition_lanes.
+    def __dispatchLanes(self):
+        inFlight = len(self.__inFlightTasks())
+
+        for lane in sorted(self.lanes.values(), key=lambda lane: lane.lastDispatch):
+            if inFlight >= max_partition_lanes or not self.__shouldRun():
+                break
+
+            if lane.task is not None or len(lane.pending) == 0:
+                continue
+
+            batch = PayloadBuilder(payload_limit)
+
+            while len(lane.pending) > 0:
+                message, encodedMessage = lane.pending[0]
+
+                if batch.add(message, encodedMessage):
+                    lane.pending.popleft()
+                elif len(batch) == 0:
+                    logging.error('[{}] Single message at offset {} exceeds payload size limit. Skipping this message!'.format(self.trigger, message.offset()))
+                    lane.pending.popleft()
+                    metrics.skippedMessages.inc(slot=self.sharedState.index)
+
+                    # nothing else from this partition is in flight
+                    if not lane.abandoned:
+                        self.commits.add([message])
+                else:
+                    break
+
+            if len(batch) > 0:
+                logging.info("[{}] Found {} messages with a total size of {} bytes in partition {}".format(self.trigger, len(batch), batch.size, lane.topicPartition.partition))
+                self.__observeBatch(batch)
+                lane.task = FireTask(batch.messages, batch.body())
+                lane.lastDispatch = time.time()
+                self.__fire(lane.task)
+                inFlight += 1
+
+            self.__updateLanePause(lane)
+
+    def __completeLaneTask(self, task):
+        message = task.messages[0]
+        lane = self.lanes.get((message.topic(), message.partition()))
+
+        if task.isComplete():
+            ownsOffsets = lane is not None and lane.task is task and not lane.taskRevoked
+
+            if task.result == FireTask.Abandoned:
+                if lane is not None:
+                    lane.abandoned = True
+            elif task.shouldCommit() and ownsOffsets and not lane.abandoned:
+                self.commits.add(task.messages)
+
+            if lane is not None and lane.task is task:
+                lane.task = None
+                lane.taskRevoked = False
+
+                if not lane.assigned and len(lane.pending) == 0:
+                    del self.lanes[(message.topic(), message.partition())]
+                    lane = None
+
+        if lane is not None:
+            self.__updateLanePause(lane)
+
+    # A lane's partition is paused while its batch is waiting to be retried, or
+    # while it holds a full batch of messages waiting to be fired, so that the
+    # other partitions keep flowing.
+    def __updateLanePause(self, lane):
+        shouldPause = lane.assigned and (lane.isRetrying() or len(lane.pending) >= consume_batch_size)
+
+        if shouldPause != lane.paused and self.consumer is not None:
+            if shouldPause:
+                logging.debug('[{}] Pausing partition {}'.format(self.trigger, lane.topicPartition.partition))
+                self.consumer.pause([lane.topicPartition])
+            else:
+                logging.debug('[{}] Resuming partition {}'.format(self.trigger, lane.topicPartition.partition))
+                self.consumer.resume([lane.topicPartition])
+
+            lane.paused = shouldPause
+
+    # whether any lane could be fired right away
+    def __lanesHaveBacklog(self):
+        for lane in self.lanes.values():
+            if lane.task is None and len(lane.pending) > 0:
+                return True
+
+        return False
+
+    # While a failed fire is waiting to be retried the partitions are paused,
+    # but we must keep polling in order to remain in the consumer group.
+    def __pollWhilePaused(self):
+        message = self.consumer.poll(min(self.retries.secondsUntilNextDue(), 1.0))
+
+        if message is not None:
+            # hold onto anything that was fetched before the partitions were paused
+            self.queuedMessages.extend(self.__encode([message]))
+
+        self.updateLastPoll()
+
+    def __pause(self):
+        if self.paused is None:
+            self.paused = self.consumer.assignment()
+            logging.info('[{}] Pausing {} partitions until the trigger can be fired'.format(self.trigger, len(self.paused)))
+            self.consumer.pause(self.paused)
+
+    def __resume(self):
+        logging.info('[{}] Resuming {} partitions'.format(self.trigger, len(self.paused)))
+        self.consumer.resume(self.paused)
+        self.paused = None
+
+    # make a single attempt to fire the trigger, returning the FireTask result
+    def __fireTrigger(self, task):
+        if not self.__shouldRun():
+            return FireTask.Abandoned
+
+        messages = task.messages
+        task.attempts += 1
+
+        logging.info("[{}] Firing trigger with {} messages".format(self.trigger, len(messages)))
+
+        try:
+            fireStart = time.time()
+            try:
+                response = self.session.post(self.triggerURL, data=task.body, headers=json_headers, auth=self.authHandler, timeout=10.0, verify=check_ssl)
+            finally:
+                fireSeconds = time.time() - fireStart
+                self.sharedState.recordFire(fireSeconds, connectionsOpened(self.session))
+                metrics.fireSeconds.observe(fireSeconds, slot=self.sharedState.index)
+            status_code = response.status_code
+            metrics.fires.inc(labelValue=str(status_code), slot=self.sharedState.index)
+            logging.info("[{}] Response status code {}".format(self.trigger, status_code))
+
+            # Manually commit offset if the trigger was fired successfully. Retry firing the trigger
+            # for a select set of status codes
+            if status_code in range(200, 300):
+                if status_code == 204:
+                    logging.info("[{}] Successfully fired trigger".format(self.trigger))
+                else:
+                    response_json = response.json()
+                    if 'activationId' in response_json and response_json['activationId'] is not None:
+                        logging.info("[{}] Fired trigger with activation {}".format(self.trigger, response_json['activationId']))
                     else:
-                        logging.warn("[{}] Skipping {} messages to offset {} of partition {}".format(self.trigger, len(messages), lastMessage.offset(), lastMessage.partition()))
-                        self.consumer.commit(offsets=self.__getOffsetList(messages), async=False)
-                        retry = False
+                        logging.info("[{}] Successfully fired trigger".format(self.trigger))
+                # the consumer may have consumed messages that did not make it into the messages array.
+                # be sure to only commit to the messages that were actually fired.
+                return FireTask.Fired
+            elif self.__shouldDisable(status_code):
+                logging.error('[{}] Error talking to OpenWhisk, status code {}'.format(self.trigger, status_code))
+                self.__dumpRequestResponse(response)
+                self.__disableTrigger(status_code)
+                return FireTask.Abandoned
+        except requests.exceptions.RequestException as e:
+            metrics.fires.inc(labelValue='error', slot=self.sharedState.index)
+            logging.error('[{}] Error talking to OpenWhisk: {}'.format(self.trigger, e))
+        except AuthHandlerException as e:
+            metrics.fires.inc(labelValue='error', slot=self.sharedState.index)
+            logging.error("[{}] Encountered an exception from auth handler, status code {}".format(self.trigger, e.response.status_code))
+            self.__dumpRequestResponse(e.response)
+
+            if self.__shouldDisable(e.response.status_code):
+                self.__disableTrigger(e.response.status_code)
+                return FireTask.Abandoned
+
+        return FireTask.Failed
 
     def __disableTrigger(self, status_code):
         self.setDesiredState(Consumer.State.Disabled)
-
-        # when failing to establish a database connection, mark the consumer as dead to restart the consumer
-        try:
-            self.database = Database()
-            self.database.disableTrigger(self.trigger, status_code)
-        except Exception as e:
-            logging.error('[{}] Uncaught exception: {}'.format(self.trigger, e))
-            self.__recordState(Consumer.State.Dead)
-        finally:
-            self.database.destroy()
+        statusUpdates.put((self.trigger, status_code, long(time.time() * 1000)))
 
     def __dumpRequestResponse(self, response):
         response_dump = {
@@ -474,86 +1229,12 @@ class ConsumerProcess (Process):
 
         logging.error('[{}] Dumping the content of the request and response:\n{}'.format(self.trigger, response_dump))
 
-    # return the dict that will be sent as the trigger payload
-    def __getMessagePayload(self, message):
-        return {
-            'value': self.__encodeMessageIfNeeded(message.value()),
-            'topic': message.topic(),
-            'partition': message.partition(),
-            'offset': message.offset(),
-            'key': self.__encodeKeyIfNeeded(message.key())
-        }
-
-    # return the size in bytes of the trigger payload for this message
-    def __sizeMessage(self, message):
-        messagePayload = self.__getMessagePayload(message)
-        return len(json.dumps(messagePayload).encode('utf-8'))
-
-    # return list of TopicPartition which represent the _next_ offset to consume
-    def __getOffsetList(self, messages):
-        offsets = []
-        for message in messages:
-            # Add one to the offset, otherwise we'll consume this message again.
-            # That's just how Kafka works, you place the bookmark at the *next* message.
-            offsets.append(TopicPartition(message.topic(), message.partition(), message.offset() + 1))
-
-        return offsets
-
-    def __getUTF8Encoding(self, value):
-        try:
-            value.decode('utf-8')
-        except UnicodeDecodeError:
-            try:
-                logging.debug('[{}] Value is not UTF-8 encoded. Attempting encoding...'.format(self.trigger))
-                value = value.encode('utf-8')
-            except UnicodeDecodeError:
-                logging.debug('[{}] Value contains non-unicode bytes. Replacing invalid bytes.'.format(self.trigger))
-                value = unicode(value, errors='replace').encode('utf-8')
-        except AttributeError:
-            logging.debug('[{}] Cannot decode a NoneType message value'.format(self.trigger))
-
-        return value
-
-
-    def __encodeMessageIfNeeded(self, value):
-        value = self.__getUTF8Encoding(value)
-
-        if self.encodeValueAsJSON:
-            try:
-                parsed = json.loads(value, parse_constant=self.__errorOnJSONConstant, parse_float=self.__parseFloat)
-                logging.debug('[{}] Successfully encoded a message as JSON.'.format(self.trigger))
-                return parsed
-            except ValueError as e:
-                # message is not a JSON object, return the message as a JSON value
-                logging.debug('[{}] I was asked to encode a message as JSON, but I failed with "{}".'.format(self.trigger, e))
-                value = "\"{}\"".format(value)
-                return value
-        elif self.encodeValueAsBase64:
-            try:
-                parsed = value.encode("base64").strip()
-                logging.debug('[{}] Successfully encoded a binary message.'.format(self.trigger))
-                return parsed
-            except:
-                logging.debug('[{}] Unable to encode a binary message.'.format(self.trigger))
-                pass
-
-        logging.debug('[{}] Returning un-encoded message'.format(self.trigger))
-        return value
-
-    def __encodeKeyIfNeeded(self, key):
-        if self.encodeKeyAsBase64:
-            try:
-                parsed = key.encode("base64").strip()
-                logging.debug('[{}] Successfully encoded a binary key.'.format(self.trigger))
-                return parsed
-            except:
-                logging.debug('[{}] Unable to encode a binary key.'.format(self.trigger))
-                pass
-
-        key = self.__getUTF8Encoding(key)
-
-        logging.debug('[{}] Returning un-encoded message'.format(self.trigger))
-        return key
+    # pair each message with its JSON encoding as it will appear in the trigger
+    # payload, or None if the message carries an error. Every polled message
+    # passes through here, so this is also where the LagTracker sees them.
+    def __encode(self, messages):
+        self.lag.observe(messages, self.commits)
+        return zip(messages, self.codec.encodeBatch(messages))
 
     def __on_assign(self, consumer, partitions):
         logging.info('[{}] Completed partition assignment. Connected to broker(s)'.format(self.trigger))
@@ -565,16 +1246,48 @@ class ConsumerProcess (Process):
     def __on_revoke(self, consumer, partitions):
         logging.info('[{}] Partition assignment has been revoked. Disconnected from broker(s)'.format(self.trigger))
 
-    def __errorOnJSONConstant(self, data):
-    	raise(ValueError('Constant "{}" detected in JSON.'.format(data)))
+        # commit whatever we have while we still own the partitions
+        try:
+            self.commits.flush(consumer, async=False)
+        except Exception as e:
+            logging.error('[{}] Failed to commit offsets on revoke: {}'.format(self.trigger, e))
 
-    def __parseFloat(self, data):
-        res = float(data)
+        revoked = set((partition.topic, partition.partition) for partition in partitions)
+        self.commits.forget(revoked)
+        self.lag.forget()
 
-        if res == float('inf'):
-            raise(ValueError('Parsing float value "{}" would result in "Infinity".'.format(data)))
+        # Messages polled from these partitions will be consumed again by their
+        # new owner, so drop them. Batches in flight are left to complete, but
+        # their messages from these partitions are neither retried nor committed.
+        if self.lanes is not None:
+            for key in revoked:
+                lane = self.lanes.get(key)
 
-        if res == float('-inf'):
-            raise(ValueError('Parsing float value "{}" would result in "-Infinity".'.format(data)))
+                if lane is not None:
+                    lane.pending.clear()
 
-        return res
+                    if lane.task is None:
+                        del self.lanes[key]
+                    else:
+                        lane.task.revoked.add(key)
+                        lane.assigned = False
+                        lane.taskRevoked = True
+                        lane.paused = False
+        else:
+            self.queuedMessages = [(message, encodedMessage) for message, encodedMessage in self.queuedMessages if (message.topic(), message.partition()) not in revoked]
+
+            if self.overflow is not None and (self.overflow[0].topic(), self.overflow[0].partition()) in revoked:
+                self.overflow = None
+
+            for task in self.outstanding:
+                task.revoked.update(revoked)
+
+            if self.paused is not None:
+                self.paused = [partition for partition in self.paused if (partition.topic, partition.partition) not in revoked]
+
+    # called from within poll() every KAFKA_STATS_INTERVAL milliseconds
+    def __onStats(self, statsJSON):
+        try:
+            self.sharedState.recordKafkaStats(metrics.reduceKafkaStats(statsJSON))
+        except Exception as e:
+            logging.warn('[{}] Unable to record Kafka statistics: {}'.format(self.trigger, e))
@@ -30,6 +30,15 @@ class ConsumerCollection:
     def __init__(self):
         self.consumers = dict()
         self.lock = Lock()
+        self.listeners = []
+
+        # consumers that have been removed or replaced, but whose process has
+        # not yet stopped, so their state cannot be released yet
+        self.retiring = []
+
+    # the listener is called with the trigger FQN whenever a consumer is added
+    def addListener(self, listener):
+        self.listeners.append(listener)
 
     def getCopyForRead(self):
         with self.lock:
@@ -51,8 +60,33 @@ class ConsumerCollection:
 
     def addConsumerForTrigger(self, triggerFQN, consumer):
         with self.lock:
+            replaced = self.consumers.get(triggerFQN)
             self.consumers[triggerFQN] = consumer
 
+        if replaced is not None and replaced is not consumer:
+            self.__retire(replaced)
+
+        for listener in self.listeners:
+            listener(triggerFQN)
+
     def removeConsumerForTrigger(self, triggerFQN):
         with self.lock:
-            del self.consumers[triggerFQN]
+            consumer = self.consumers.pop(triggerFQN)
+
+        self.__retire(consumer)
+
+    # release the state of retired consumers whose process has since stopped
+    def releaseStoppedConsumers(self):
+        with self.lock:
+            retiring = self.retiring
+            self.retiring = []
+
+        for consumer in retiring:
+            self.__retire(consumer)
+
+    def __retire(self, consumer):
+        if consumer.isProcessAlive():
+            with self.lock:
+                self.retiring.append(consumer)
+        else:
+            consumer.releaseState()
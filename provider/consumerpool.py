@@ -0,0 +1,232 @@
+"""ConsumerPool class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import itertools
+import logging
+
+from consumer import ConsumerRunner, processMemory
+from eventpipe import EventPipe
+from multiprocessing import Pipe, Process
+from Queue import Empty
+from threading import Event, Lock, Thread
+
+
+# A fixed number of worker processes, each hosting many ConsumerRunners on
+# their own threads. This avoids paying for one OS process (and Python
+# interpreter) per trigger.
+#
+# Nothing that crosses between the processes is guarded by a lock shared with
+# a worker, so a worker that dies mid-write cannot leave the others stuck:
+# runners are handed to each worker down a pipe of its own, and workers report
+# exits through an EventPipe.
+class ConsumerPool:
+    # how often to check that the worker processes are still alive
+    monitor_interval_seconds = 5
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = Lock()
+        self.tokens = itertools.count()
+        self.stopped = False
+        self.monitor = None
+
+        # every runner that has been started and has not yet exited, by token
+        self.processes = dict()
+
+        # worker processes report the token of each runner that exits here
+        self.exits = EventPipe()
+        self.workers = [ConsumerPoolWorker(index, self.exits) for index in range(size)]
+
+    def start(self):
+        logging.info('[pool] Starting {} consumer worker processes'.format(self.size))
+
+        for worker in self.workers:
+            worker.start()
+
+        self.monitor = Thread(target=self.__monitor)
+        self.monitor.daemon = True
+        self.monitor.start()
+
+    def stop(self):
+        self.stopped = True
+
+        for worker in self.workers:
+            worker.terminate()
+
+        # wake the monitor, no runner has this token
+        self.exits.put(None)
+
+    # returns an object that can stand in for a ConsumerProcess
+    def newProcess(self, spec, sharedState):
+        return PooledConsumerProcess(self, next(self.tokens), spec, sharedState)
+
+    def submit(self, process):
+        with self.lock:
+            # place the runner on the least loaded worker
+            worker = min(self.workers, key=lambda w: w.load)
+            worker.load += 1
+            process.worker = worker
+            self.processes[process.token] = process
+
+        logging.info('[{}] Starting consumer on worker process {}'.format(process.trigger, worker.index))
+
+        try:
+            worker.send((process.token, process.spec, process.sharedState))
+        except (IOError, OSError) as e:
+            # the worker has died; once it is replaced the runner is reported
+            # as exited along with the rest of its orphans
+            logging.error('[{}] Failed to hand consumer to worker process {}: {}'.format(process.trigger, worker.index, e))
+
+    # the memory of each worker process, which is shared by all of its runners
+    def stats(self):
+        with self.lock:
+            workers = list(self.workers)
+
+        workerStats = []
+
+        for worker in workers:
+            memory = processMemory(worker.pid)
+            rssBytes, sharedBytes = memory if memory is not None else (0, 0)
+
+            workerStats.append({
+                'index': worker.index,
+                'pid': worker.pid,
+                'consumers': worker.load,
+                'rssBytes': rssBytes,
+                'sharedBytes': sharedBytes
+            })
+
+        return workerStats
+
+    def __monitor(self):
+        while not self.stopped:
+            try:
+                token = self.exits.get(timeout=self.monitor_interval_seconds)
+                self.__recordExit(token)
+            except Empty:
+                pass
+            except Exception as e:
+                logging.error('[pool] Uncaught exception while collecting exits: {}'.format(e))
+
+            if not self.stopped:
+                self.__replaceDeadWorkers()
+
+    def __recordExit(self, token):
+        with self.lock:
+            process = self.processes.pop(token, None)
+
+            if process is not None:
+                process.worker.load -= 1
+
+        if process is not None:
+            process.exited.set()
+
+    def __replaceDeadWorkers(self):
+        for index, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                logging.error('[pool] Worker process {} died unexpectedly. Replacing it.'.format(index))
+
+                with self.lock:
+                    orphans = [p for p in self.processes.values() if p.worker is worker]
+                    for process in orphans:
+                        del self.processes[process.token]
+
+                    replacement = ConsumerPoolWorker(index, self.exits)
+                    replacement.start()
+                    self.workers[index] = replacement
+
+                # the runners died along with the worker; the Doctor will
+                # restart them once they are overdue for a poll
+                for process in orphans:
+                    process.exited.set()
+
+
+class ConsumerPoolWorker (Process):
+    def __init__(self, index, exits):
+        Process.__init__(self)
+
+        self.daemon = True
+        self.index = index
+        self.exits = exits
+        self.commands = None
+        self.sender = None
+
+        # only used in the parent, where several threads may start runners at
+        # once and a command may be too large to be written atomically
+        self.sendLock = Lock()
+
+        # number of runners assigned to this worker, only tracked in the parent
+        self.load = 0
+
+    def start(self):
+        # the pipe is created right before the worker is forked and the parent
+        # closes its reading end straight after, so the worker holds the only
+        # copy. Sending to a worker that has died then fails rather than
+        # filling up the pipe.
+        self.commands, self.sender = Pipe(duplex=False)
+        Process.start(self)
+        self.commands.close()
+
+    def send(self, command):
+        with self.sendLock:
+            self.sender.send(command)
+
+    def run(self):
+        while True:
+            token, spec, sharedState = self.commands.recv()
+
+            thread = Thread(target=self.__runConsumer, args=(token, spec, sharedState))
+            thread.daemon = True
+            thread.start()
+
+    def __runConsumer(self, token, spec, sharedState):
+        try:
+            sharedState.recordWorker(self.index)
+            ConsumerRunner(spec, sharedState).run()
+        except Exception as e:
+            logging.error('[{}] Uncaught exception in pooled consumer: {}'.format(spec.trigger, e))
+        finally:
+            self.exits.put(token)
+
+
+# Exposes the subset of the multiprocessing.Process interface that Consumer,
+# Service and TheDoctor rely upon, for a runner hosted by the ConsumerPool.
+class PooledConsumerProcess:
+    def __init__(self, pool, token, spec, sharedState):
+        self.pool = pool
+        self.token = token
+        self.trigger = spec.trigger
+        self.spec = spec
+        self.sharedState = sharedState
+
+        self.worker = None
+        self.started = False
+        self.exited = Event()
+
+    def start(self):
+        self.started = True
+        self.pool.submit(self)
+
+    def is_alive(self):
+        return self.started and not self.exited.is_set()
+
+    def join(self, timeout=None):
+        if self.started:
+            self.exited.wait(timeout)
@@ -0,0 +1,130 @@
+"""ConsumerRestarter class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import heapq
+import itertools
+import logging
+import time
+
+from threading import Condition, Thread
+
+
+# Restarts consumers on a small pool of threads, so that a consumer that is
+# slow to stop never holds up the Doctor, or any other restart.
+#
+# Each consumer is restarted after an exponential backoff based upon how many
+# times it has been restarted recently, and restarts are spaced out so that no
+# more than maxPerSecond begin in any second. A broker outage that takes down
+# many consumers therefore does not bring all of them back at once.
+class ConsumerRestarter:
+    backoff_base_seconds = 1
+    backoff_max_seconds = 300
+
+    def __init__(self, consumerCollection, workers, maxPerSecond):
+        self.consumerCollection = consumerCollection
+        self.interval = 1.0 / maxPerSecond
+        self.nextStart = 0
+
+        self.heap = []
+        self.counter = itertools.count()
+        self.pending = set()
+        self.condition = Condition()
+        self.stopped = False
+
+        self.threads = []
+        for index in range(workers):
+            thread = Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # returns False if a restart is already pending for the consumer
+    def schedule(self, consumer):
+        with self.condition:
+            if consumer.trigger in self.pending:
+                return False
+
+            delay = self.__backoff(consumer.restartCount())
+            self.pending.add(consumer.trigger)
+            self.__push(consumer, delay)
+
+        logging.info('[{}] Restarting consumer in {:.1f} second(s)'.format(consumer.trigger, delay))
+        return True
+
+    # stop restarting consumers, leaving any restarts that are still pending
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def __backoff(self, restartCount):
+        if restartCount == 0:
+            return 0
+
+        return min(self.backoff_base_seconds * pow(2, restartCount - 1), self.backoff_max_seconds)
+
+    # must be called with the condition held
+    def __push(self, consumer, delay):
+        heapq.heappush(self.heap, (time.time() + delay, next(self.counter), consumer))
+        self.condition.notify()
+
+    # wait for the next restart that is due, and allowed by the rate limit, or
+    # return None once stopped
+    def __next(self):
+        with self.condition:
+            while not self.stopped:
+                now = time.time()
+
+                if len(self.heap) == 0:
+                    self.condition.wait()
+                elif self.heap[0][0] > now or self.nextStart > now:
+                    self.condition.wait(max(self.heap[0][0], self.nextStart) - now)
+                else:
+                    self.nextStart = now + self.interval
+                    return heapq.heappop(self.heap)[2]
+
+            return None
+
+    def __work(self):
+        while True:
+            consumer = self.__next()
+
+            if consumer is None:
+                return
+
+            restarted = False
+
+            try:
+                # the trigger may have been deleted, or replaced by a new
+                # consumer, while the restart was waiting
+                if self.consumerCollection.getConsumerForTrigger(consumer.trigger) is not consumer:
+                    logging.info('[{}] Consumer is no longer in the collection, not restarting it'.format(consumer.trigger))
+                    restarted = True
+                else:
+                    restarted = consumer.restart()
+            except Exception as e:
+                logging.error('[{}] Uncaught exception while restarting consumer: {}'.format(consumer.trigger, e))
+
+            with self.condition:
+                if restarted:
+                    self.pending.discard(consumer.trigger)
+                else:
+                    # the consumer has not stopped yet, try again later
+                    self.__push(consumer, self.__backoff(consumer.restartCount()))
@@ -0,0 +1,152 @@
+"""ConsumerSpawner class, SpawnedConsumerProcess class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import logging
+import os
+import signal
+import time
+
+import metrics
+
+from consumer import ConsumerRunner, SharedState, stateTable
+from multiprocessing import Pipe, Process
+from threading import Lock
+
+
+# A small process that forks consumer processes on behalf of the main process.
+# It is itself forked before the main process imports the web server and the
+# rest of what only the main process needs, and it never starts a thread, so
+# every consumer is forked from the same small, quiet image and shares its
+# pages copy-on-write.
+#
+# The spawner reaps its own children, and publishes each one's pid and whether
+# it is still running to the consumer's slot in the state table.
+class ConsumerSpawner (Process):
+    # how often to check for exited children while no requests arrive
+    reap_interval_seconds = 0.5
+
+    # the states of the process of a consumer slot
+    NotStarted = 0
+    Requested = 1
+    Running = 2
+    Exited = 3
+
+    def __init__(self):
+        Process.__init__(self)
+
+        self.daemon = True
+        self.requests, self.requestsReader = Pipe()
+        self.lock = Lock()
+
+    # returns an object that can stand in for a ConsumerProcess
+    def newProcess(self, spec, sharedState):
+        return SpawnedConsumerProcess(self, spec, sharedState)
+
+    def spawn(self, process):
+        process.sharedState.slot.processState = self.Requested
+
+        with self.lock:
+            self.requests.send((process.spec, process.sharedState.index, time.time()))
+
+    def run(self):
+        self.requests.close()
+        children = dict()
+
+        while True:
+            try:
+                if self.requestsReader.poll(self.reap_interval_seconds):
+                    spec, index, requested = self.requestsReader.recv()
+                    pid = self.__fork(spec, index, requested)
+                    children[pid] = index
+
+                self.__reap(children)
+            except EOFError:
+                # the main process has gone away
+                return
+            except Exception as e:
+                logging.error('[spawner] Uncaught exception: {}'.format(e))
+
+    def __fork(self, spec, index, requested):
+        slot = stateTable.slot(index)
+        pid = os.fork()
+
+        if pid == 0:
+            status = 0
+
+            try:
+                self.requestsReader.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+                sharedState = SharedState(index)
+                sharedState.recordSpawn(time.time() - requested)
+                metrics.spawnSeconds.observe(time.time() - requested, slot=index)
+
+                ConsumerRunner(spec, sharedState).run()
+            except Exception as e:
+                logging.error('[{}] Uncaught exception in spawned consumer: {}'.format(spec.trigger, e))
+                status = 1
+            finally:
+                os._exit(status)
+
+        slot.pid = pid
+        slot.processState = self.Running
+
+        return pid
+
+    def __reap(self, children):
+        while len(children) > 0:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+
+            if pid == 0:
+                return
+
+            index = children.pop(pid, None)
+            if index is not None:
+                stateTable.slot(index).processState = self.Exited
+
+
+# Exposes the subset of the multiprocessing.Process interface that Consumer,
+# Service and TheDoctor rely upon, for a consumer forked by the ConsumerSpawner.
+class SpawnedConsumerProcess:
+    join_poll_seconds = 0.05
+
+    def __init__(self, spawner, spec, sharedState):
+        self.spawner = spawner
+        self.trigger = spec.trigger
+        self.spec = spec
+        self.sharedState = sharedState
+
+    def start(self):
+        self.spawner.spawn(self)
+
+    def is_alive(self):
+        return self.sharedState.slot.processState in [ConsumerSpawner.Requested, ConsumerSpawner.Running]
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+
+        while self.is_alive() and (deadline is None or time.time() < deadline):
+            time.sleep(self.join_poll_seconds)
+
+    def terminate(self):
+        slot = self.sharedState.slot
+
+        if slot.processState == ConsumerSpawner.Running:
+            os.kill(slot.pid, signal.SIGTERM)
@@ -0,0 +1,117 @@
+"""ConsumerStarter class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import heapq
+import itertools
+import logging
+import time
+
+from consumer import Consumer
+from threading import Condition, Thread
+
+
+# Starts new consumers in priority order, rather than all at once. At most
+# `concurrency` consumers are allowed to be connecting to their brokers at any
+# time, and no more than maxPerSecond are started in any second, so that a
+# worker coming up with thousands of triggers does not open thousands of
+# connections in one burst.
+#
+# A consumer counts as connecting from when it is started until it reaches the
+# Running state, or until connect_timeout_seconds have passed.
+class ConsumerStarter (Thread):
+    connect_timeout_seconds = 30
+
+    def __init__(self, concurrency, maxPerSecond):
+        Thread.__init__(self)
+        self.daemon = True
+
+        self.concurrency = concurrency
+        self.interval = 1.0 / maxPerSecond
+        self.nextStart = 0
+
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.stopped = False
+
+        # (time started, consumer) for the consumers that are still connecting
+        self.connecting = []
+
+    # Lower priorities are started first. Consumers with the same priority are
+    # started in the order in which they were scheduled.
+    def schedule(self, consumer, priority):
+        with self.condition:
+            heapq.heappush(self.heap, (priority, next(self.counter), consumer))
+            self.condition.notify()
+
+    # stop starting consumers, leaving any that are still scheduled
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            try:
+                consumer = self.__next()
+
+                if consumer is None:
+                    return
+
+                self.__start(consumer)
+            except Exception as e:
+                logging.error('[starter] Uncaught exception while starting consumer: {}'.format(e))
+
+    # wait for the next consumer to start, as allowed by the limits, or return
+    # None once stopped
+    def __next(self):
+        with self.condition:
+            while not self.stopped:
+                now = time.time()
+                self.__pruneConnecting(now)
+
+                if len(self.heap) == 0:
+                    self.condition.wait()
+                elif len(self.connecting) >= self.concurrency:
+                    # there's no notification for a consumer becoming Running
+                    self.condition.wait(0.1)
+                elif self.nextStart > now:
+                    self.condition.wait(self.nextStart - now)
+                else:
+                    self.nextStart = now + self.interval
+                    return heapq.heappop(self.heap)[2]
+
+            return None
+
+    def __pruneConnecting(self, now):
+        self.connecting = [(started, consumer) for started, consumer in self.connecting
+                           if consumer.currentState() == Consumer.State.Initializing and now - started < self.connect_timeout_seconds]
+
+    def __start(self, consumer):
+        if consumer.desiredState() == Consumer.State.Running:
+            logging.info('[{}] Starting consumer'.format(consumer.trigger))
+            consumer.start()
+
+            with self.condition:
+                self.connecting.append((time.time(), consumer))
+        else:
+            # the trigger was disabled or deleted while it was waiting
+            logging.info('[{}] Not starting consumer because its desired state is {}'.format(consumer.trigger, consumer.desiredState()))
+            consumer.abandon()
@@ -18,14 +18,17 @@
  */
 """
 
+import json
 import logging
 import os
 import time
 
 from cloudant.client import CouchDB
 from cloudant.client import CouchDatabase
+from cloudant.document import Document
 from cloudant.result import Result
 from datetime import datetime
+from requests.exceptions import HTTPError
 
 
 class Database:
@@ -43,12 +46,19 @@ class Database:
     instance = os.getenv('INSTANCE', 'messageHubTrigger-0')
     canaryId = "canary-{}".format(instance)
 
+    # the changes feed filter that only passes what this worker cares about
+    worker = os.getenv('WORKER', 'worker0')
+    worker_filter_id = 'for-{}'.format(worker)
+
     def __init__(self, timeout=None):
         self.client = CouchDB(self.username, self.password, url=self.url, timeout=timeout, auto_renew=True)
         self.client.connect()
 
         self.database = CouchDatabase(self.client, self.dbname)
 
+        self.canaryDocument = Document(self.database, self.canaryId)
+        self.canaryRev = None
+
         if self.database.exists():
             logging.info('Database exists - connecting to it.')
         else:
@@ -60,70 +70,114 @@ class Database:
             self.client.disconnect()
             self.client = None
 
-    def disableTrigger(self, triggerFQN, status_code, message='Automatically disabled after receiving a {} status code when firing the trigger.'):
-        try:
-            document = self.database[triggerFQN]
-
-            if document.exists():
-                logging.info('Found trigger to disable from DB: {}'.format(triggerFQN))
-
-                status = {
-                    'active': False,
-                    'dateChanged': long(time.time() * 1000),
-                    'reason': {
-                        'kind': 'AUTO',
-                        'statusCode': status_code,
-                        'message': message.format(status_code)
-                    }
+    # Records each trigger in updates, a dict of triggerFQN -> (status_code,
+    # dateChanged), as automatically disabled, using one request to fetch the
+    # documents and one to save them. Returns the set of triggers whose
+    # documents changed in the meantime, which should be written again.
+    def disableTriggers(self, updates, message='Automatically disabled after receiving a {} status code when firing the trigger.'):
+        result = self.database.all_docs(keys=updates.keys(), include_docs=True)
+        documents = [row['doc'] for row in result['rows'] if row.get('doc') is not None]
+
+        for document in documents:
+            status_code, dateChanged = updates[document['_id']]
+            document['status'] = {
+                'active': False,
+                'dateChanged': dateChanged,
+                'reason': {
+                    'kind': 'AUTO',
+                    'statusCode': status_code,
+                    'message': message.format(status_code)
                 }
+            }
+
+        if len(documents) == 0:
+            return set()
+
+        conflicts = set()
+
+        for response in self.database.bulk_docs(documents):
+            if response.get('error') == 'conflict':
+                conflicts.add(response['id'])
+            elif 'error' in response:
+                logging.error('[{}] Failed to record trigger as disabled: {}'.format(response['id'], response.get('reason')))
+            else:
+                logging.info('{} Successfully recorded trigger as disabled.'.format(response['id']))
+
+        return conflicts
 
-                document['status'] = status
-                document.save()
+    # Returns the active trigger documents assigned to the worker, along with a
+    # sequence from which to follow the changes feed. The sequence is read
+    # before the view is queried, so following changes from it may replay
+    # some changes already reflected in the documents, but never misses one.
+    def activeTriggersForWorker(self, workerId):
+        sequence = self.database.metadata()['update_seq']
+        result = self.database.get_view_result(self.filters_design_doc_id, self.by_worker_view_id, raw_result=True, key=workerId, reduce=False, include_docs=True)
 
-                logging.info('{} Successfully recorded trigger as disabled.'.format(triggerFQN))
-        except Exception as e:
-            logging.error('[{}] Uncaught exception while disabling trigger: {}'.format(triggerFQN, e))
+        return sequence, [row['doc'] for row in result['rows']]
+
+    # the IDs of the active triggers assigned to the worker
+    def activeTriggerIdsForWorker(self, workerId):
+        result = self.database.get_view_result(self.filters_design_doc_id, self.by_worker_view_id, raw_result=True, key=workerId, reduce=False)
+
+        return set(row['id'] for row in result['rows'])
 
     def changesFeed(self, timeout, since=None):
+        workerFilter = 'filters/{}'.format(self.worker_filter_id)
+
         if since == None:
-            return self.database.infinite_changes(include_docs=True, heartbeat=(timeout*1000))
+            return self.database.infinite_changes(include_docs=True, heartbeat=(timeout*1000), filter=workerFilter)
         else:
-            return self.database.infinite_changes(include_docs=True, heartbeat=(timeout*1000), since=since)
+            return self.database.infinite_changes(include_docs=True, heartbeat=(timeout*1000), filter=workerFilter, since=since)
 
+    # Writes this instance's canary document with a single PUT, using the
+    # revision from the previous write. The revision is only fetched when it
+    # is not known, or the document was changed elsewhere.
     def createCanary(self):
         maxRetries = 3
         retryCount = 0
 
         while retryCount < maxRetries:
             try:
-                if self.canaryId in self.database.keys(remote=True):
-                    # update the timestamp to cause a document change
-                    logging.debug("[database] Canary doc exists, updating it.")
+                document = {
+                    '_id': self.canaryId,
+                    'canary-timestamp': datetime.now().isoformat(),
+                    'canary-time': time.time()
+                }
 
-                    myCanaryDocument = self.database[self.canaryId]
-                    myCanaryDocument["canary-timestamp"] = datetime.now().isoformat()
-                    myCanaryDocument.save()
+                if self.canaryRev is not None:
+                    document['_rev'] = self.canaryRev
 
-                    return
-                else:
-                    # create the canary doc for this instance
-                    logging.debug("[database] Canary doc does not exist, creating it.")
+                response = self.client.r_session.put(self.canaryDocument.document_url, data=json.dumps(document), headers={'Content-Type': 'application/json'})
 
-                    document = dict()
-                    document['_id'] = self.canaryId
-                    document['canary-timestamp'] = datetime.now().isoformat()
+                if response.status_code == 409:
+                    logging.debug("[database] Canary doc has an unexpected revision, fetching it.")
+                    self.canaryRev = self.__currentRev(self.canaryDocument)
+                    retryCount += 1
+                    continue
 
-                    result = self.database.create_document(document)
-                    logging.debug('[canary] Successfully wrote canary to DB')
+                response.raise_for_status()
+                self.canaryRev = response.json()['rev']
+                logging.debug('[canary] Successfully wrote canary to DB')
 
-                    return
+                return
             except Exception as e:
                 retryCount += 1
+                self.canaryRev = None
                 logging.error(
                     '[canary] Uncaught exception while writing canary document: {}'.format(e))
 
         logging.error('[canary] Retried and failed {} times to create a canary'.format(maxRetries))
 
+    # the revision of the document, or None if it does not exist
+    def __currentRev(self, document):
+        response = self.client.r_session.head(document.document_url)
+
+        if response.status_code == 404:
+            return None
+
+        response.raise_for_status()
+        return response.headers['ETag'].strip('"')
+
     def migrate(self):
         logging.info('Starting DB migration')
 
@@ -136,11 +190,55 @@ class Database:
             'reduce': '_count'
         }
 
+        # Passes deletions, canaries, and the trigger documents assigned to this
+        # worker. Disabled triggers are passed to every worker, because when a
+        # trigger is reassigned it is first disabled while still assigned to
+        # its old worker, which must see that in order to stop its consumer.
+        # Should the feed coalesce those revisions, the Service reconciles its
+        # consumers against the by-worker view.
+        worker_filter = """function(doc, req) {
+                            if(doc._deleted || doc['canary-timestamp']) {
+                                return true;
+                            }
+
+                            if(doc.triggerURL) {
+                                return (doc.worker || 'worker0') === %s || (doc.status !== undefined && !doc.status.active);
+                            }
+
+                            return false;
+                        }""" % json.dumps(self.worker)
+
+        # every worker migrates the same design doc when it starts, so another
+        # may update it in between reading and saving it
+        maxRetries = 5
+        for attempt in range(maxRetries):
+            try:
+                self.__migrateFilters(by_worker_view, worker_filter)
+                break
+            except HTTPError as e:
+                if e.response is None or e.response.status_code != 409 or attempt == maxRetries - 1:
+                    raise
+
+                logging.info('The design doc was updated concurrently, reading it again')
+
+        logging.info('Database migration complete')
+
+    def __migrateFilters(self, by_worker_view, worker_filter):
         filtersDesignDoc = self.database.get_design_document(self.filters_design_doc_id)
 
         if filtersDesignDoc.exists():
+            updated = False
+
             if self.by_worker_view_id not in filtersDesignDoc["views"]:
                 filtersDesignDoc["views"][self.by_worker_view_id] = by_worker_view
+                updated = True
+
+            filters = filtersDesignDoc.setdefault("filters", dict())
+            if filters.get(self.worker_filter_id) != worker_filter:
+                filters[self.worker_filter_id] = worker_filter
+                updated = True
+
+            if updated:
                 logging.info('Updating the design doc')
                 filtersDesignDoc.save()
         else:
@@ -157,7 +255,8 @@ class Database:
                                 }"""
                     },
                     self.by_worker_view_id: by_worker_view
+                },
+                'filters': {
+                    self.worker_filter_id: worker_filter
                 }
             })
-
-        logging.info('Database migration complete')
@@ -0,0 +1,97 @@
+"""EventPipe class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import cPickle
+import errno
+import os
+import select
+import struct
+
+from Queue import Queue
+from threading import Lock, Thread
+
+
+# Carries small events from consumer processes to the main process, in place
+# of a multiprocessing.Queue. A Queue guards its pipe with a lock that is shared
+# between processes, so a consumer process that is terminated while putting an
+# event would leave the lock held and every other consumer stuck behind it.
+#
+# Instead, each event is pickled into a length-prefixed record and written to a
+# plain pipe with a single write. Writes of up to PIPE_BUF bytes to a pipe are
+# atomic, so records from different processes never interleave and no lock is
+# needed. Like the StateTable, the pipe must be created before any consumer
+# processes are forked, and events may only be read in the main process, where
+# a thread moves them from the pipe to a local queue as they arrive so that
+# writers are never held up by a slow reader.
+class EventPipe:
+    header = struct.Struct('!I')
+    read_size = 65536
+
+    def __init__(self):
+        self.reader, self.writer = os.pipe()
+        self.events = Queue()
+        self.lock = Lock()
+        self.readerThread = None
+
+    def put(self, event):
+        data = cPickle.dumps(event, cPickle.HIGHEST_PROTOCOL)
+        record = self.header.pack(len(data)) + data
+
+        if len(record) > select.PIPE_BUF:
+            raise ValueError('Event of {} bytes is too large to write atomically'.format(len(record)))
+
+        while True:
+            try:
+                os.write(self.writer, record)
+                return
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    # raises Queue.Empty if no event arrives within the timeout
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if self.readerThread is None:
+                self.readerThread = Thread(target=self.__read)
+                self.readerThread.daemon = True
+                self.readerThread.start()
+
+        return self.events.get(block, timeout)
+
+    def __read(self):
+        buffered = ''
+
+        while True:
+            try:
+                buffered += os.read(self.reader, self.read_size)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+
+            while len(buffered) >= self.header.size:
+                length, = self.header.unpack_from(buffered)
+                end = self.header.size + length
+
+                if len(buffered) < end:
+                    break
+
+                self.events.put(cPickle.loads(buffered[self.header.size:end]))
+                buffered = buffered[end:]
@@ -0,0 +1,118 @@
+"""FirePipeline class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import logging
+import time
+
+from Queue import Queue, Empty
+from threading import Thread
+
+
+# A batch of messages on its way to becoming a trigger fire
+class FireTask:
+    # the possible outcomes of firing a batch
+    Fired = 'Fired'            # the trigger was fired, commit the offsets
+    Skipped = 'Skipped'        # gave up retrying, commit the offsets anyway
+    Failed = 'Failed'          # the attempt failed, but may be retried
+    Abandoned = 'Abandoned'    # the trigger is going away, do not commit
+    Revoked = 'Revoked'        # the partitions were revoked, leave them to their new owner
+
+    def __init__(self, messages, body=None):
+        self.messages = messages
+        self.body = body
+        self.attempts = 0
+        self.result = None
+        self.polled = time.time()
+
+        # the (topic, partition) of each partition that was revoked while the
+        # batch was outstanding, whose messages must not be fired or committed
+        self.revoked = set()
+
+    # whether a final outcome has been reached for this batch
+    def isComplete(self):
+        return self.result in [FireTask.Fired, FireTask.Skipped, FireTask.Abandoned, FireTask.Revoked]
+
+    # the messages whose offsets may be committed
+    def messagesToCommit(self):
+        if len(self.revoked) == 0:
+            return self.messages
+
+        return [message for message in self.messages if (message.topic(), message.partition()) not in self.revoked]
+
+    def shouldCommit(self):
+        return self.result in [FireTask.Fired, FireTask.Skipped]
+
+
+# Makes attempts to fire tasks on `depth` background threads, so that the owner
+# can keep polling while fires are in flight. The owner is responsible for
+# committing offsets in order, as attempts may complete in any order.
+class FirePipeline:
+    def __init__(self, name, depth, fire):
+        self.name = name
+        self.depth = depth
+        self.fire = fire
+
+        self.tasks = Queue()
+        self.completions = Queue()
+        self.threads = []
+
+        for index in range(depth):
+            thread = Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, task):
+        self.tasks.put(task)
+
+    # Returns the tasks whose attempt has completed since the last call. Blocks
+    # for up to timeout seconds waiting for at least one.
+    def completed(self, timeout=0):
+        tasks = []
+
+        try:
+            if timeout > 0:
+                tasks.append(self.completions.get(timeout=timeout))
+
+            while True:
+                tasks.append(self.completions.get_nowait())
+        except Empty:
+            pass
+
+        return tasks
+
+    def stop(self):
+        for thread in self.threads:
+            self.tasks.put(None)
+
+    def __work(self):
+        while True:
+            task = self.tasks.get()
+
+            if task is None:
+                return
+
+            try:
+                task.result = self.fire(task)
+            except Exception as e:
+                logging.error('[{}] Uncaught exception while firing trigger: {}'.format(self.name, e))
+                task.result = FireTask.Failed
+            finally:
+                self.completions.put(task)
@@ -18,16 +18,22 @@
  */
 """
 
+import json
+import logging
+import time
+
 # https://pythonhosted.org/psutil/
 import psutil
 
+from consumer import Consumer
 from datetime import datetime
 from datetimeutils import secondsSince
+from metrics import aggregateKafkaStats
+from threading import Thread
 
 MILLISECONDS_IN_SECOND = 1000
 MEGABYTE = 10 ** 6
 START_TIME = datetime.now()
-CPU_INTERVAL = 0.5
 
 
 def getSwapMemory():
@@ -77,8 +83,9 @@ def getCPUTimes():
     return cpu_times
 
 
+# the utilization since the previous call, without blocking
 def getCPUPercent():
-    return '%d%%' % psutil.cpu_percent(interval=CPU_INTERVAL)
+    return '%d%%' % psutil.cpu_percent(interval=None)
 
 
 def getDiskUsage():
@@ -138,17 +145,29 @@ def getConsumers(consumers):
     for consumerId in consumerCopyRO:
         consumer = consumerCopyRO[consumerId]
         consumerInfo = {}
-        consumerInfo[consumer.params['uuid']] = {
+        consumerInfo[consumer.spec.uuid] = {
             'currentState': consumer.currentState(),
             'desiredState': consumer.desiredState(),
             'secondsSinceLastPoll': consumer.secondsSinceLastPoll(),
-            'restartCount': consumer.restartCount()
+            'restartCount': consumer.restartCount(),
+            'loopStats': consumer.loopStats(),
+            'fireStats': consumer.fireStats(),
+            'lag': consumer.lagStats(),
+            'kafkaStats': consumer.kafkaStats(),
+            'process': consumer.processStats()
         }
         consumerReports.append(consumerInfo)
 
     return consumerReports
 
 
+def getConsumerPool():
+    if Consumer.pool is None:
+        return None
+
+    return Consumer.pool.stats()
+
+
 def generateHealthReport(consumers, lastCanaryTime):
     healthReport = {}
     healthReport['last_db_canary'] = secondsSince(lastCanaryTime)
@@ -160,6 +179,40 @@ def generateHealthReport(consumers, lastCanaryTime):
     healthReport['disk_usage'] = getDiskUsage()
     healthReport['disk_io_counters'] = getDiskIOCounters()
     healthReport['net_io_counters'] = getNetworkIOCounters()
+    healthReport['kafka_stats'] = aggregateKafkaStats(consumers)
     healthReport['consumers'] = getConsumers(consumers)
+    healthReport['consumer_pool'] = getConsumerPool()
 
     return healthReport
+
+
+# Builds the health report in the background every `interval` seconds, so that
+# a request to /health only has to return the latest report, already encoded
+# as JSON, rather than wait on psutil and read every consumer's state.
+class HealthSampler (Thread):
+    def __init__(self, consumers, feedService, interval):
+        Thread.__init__(self)
+
+        self.daemon = True
+        self.consumers = consumers
+        self.feedService = feedService
+        self.interval = interval
+
+        # the first non-blocking CPU reading is meaningless, so take it now
+        psutil.cpu_percent(interval=None)
+        self.sample()
+
+    def sample(self):
+        report = generateHealthReport(self.consumers, self.feedService.lastCanaryTime)
+
+        # replacing the reference is atomic, requests see one report or the other
+        self.reportJSON = json.dumps(report)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error("[health] Uncaught exception while sampling: {}".format(e))
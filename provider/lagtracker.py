@@ -0,0 +1,146 @@
+"""LagTracker class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import logging
+import time
+
+from collections import deque
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
+
+
+# Periodically measures how far a consumer has fallen behind its topic, and
+# publishes the result to its shared state. The lag in messages is the distance
+# from the committed offset to the high watermark of each assigned partition.
+# The lag in time is estimated from the timestamp of the oldest message not yet
+# committed, on the partition that is furthest behind. It is unknown when that
+# message has not even been polled yet.
+#
+# High watermarks are taken from the consumer's cache, which is refreshed by
+# every fetch, so a sample never waits on a broker.
+class LagTracker:
+    def __init__(self, name, interval, sharedState):
+        self.name = name
+        self.interval = interval
+        self.sharedState = sharedState
+        self.lastSample = 0
+
+        # (topic, partition) -> deque of (first offset, last offset, timestamp
+        # in milliseconds of the first message or None) for each poll of the
+        # partition whose messages have not all been committed
+        self.polled = dict()
+
+    # note the offsets and timestamps of messages that have just been polled
+    def observe(self, messages, commits):
+        ranges = dict()
+
+        for message in messages:
+            if message.error():
+                continue
+
+            key = (message.topic(), message.partition())
+            offset = message.offset()
+            first = ranges.get(key)
+
+            if first is None:
+                timestampType, timestamp = message.timestamp()
+                ranges[key] = [offset, offset, None if timestampType == TIMESTAMP_NOT_AVAILABLE else timestamp]
+            else:
+                first[1] = offset
+
+        for key, (first, last, timestamp) in ranges.items():
+            polled = self.polled.setdefault(key, deque())
+            polled.append((first, last, timestamp))
+            self.__prune(polled, commits.committed.get(key))
+
+    # forget what was polled, e.g. once the partitions have been revoked
+    def forget(self):
+        self.polled = dict()
+
+    def sampleIfDue(self, consumer, commits):
+        if time.time() - self.lastSample < self.interval:
+            return
+
+        self.lastSample = time.time()
+
+        try:
+            messages, seconds = self.__measure(consumer, commits)
+            self.sharedState.recordLag(messages, seconds)
+        except Exception as e:
+            logging.warn('[{}] Unable to measure consumer lag: {}'.format(self.name, e))
+
+    # drop the polls whose messages have all been committed
+    def __prune(self, polled, committed):
+        if committed is not None:
+            while len(polled) > 0 and polled[0][1] < committed:
+                polled.popleft()
+
+    # returns the total lag in messages, and the estimated lag in seconds (or
+    # None if it cannot be estimated)
+    def __measure(self, consumer, commits):
+        assignment = consumer.assignment()
+
+        if len(assignment) == 0:
+            return 0, 0
+
+        totalMessages = 0
+        oldestTimestamp = None
+        unknownTimestamp = False
+
+        # the positions are used for partitions that have nothing committed,
+        # or polled, yet
+        for partition in consumer.position(assignment):
+            key = (partition.topic, partition.partition)
+            watermarks = consumer.get_watermark_offsets(partition, cached=True)
+
+            if watermarks is None or watermarks[1] < 0:
+                continue
+
+            polled = self.polled.get(key, deque())
+            committed = commits.committed.get(key)
+            self.__prune(polled, committed)
+
+            if committed is not None:
+                offset = committed
+            elif len(polled) > 0:
+                offset = polled[0][0]
+            elif partition.offset >= 0:
+                offset = partition.offset
+            else:
+                continue
+
+            lag = max(watermarks[1] - offset, 0)
+
+            if lag > 0:
+                totalMessages += lag
+
+                # the oldest uncommitted message is in the first poll left
+                timestamp = polled[0][2] if len(polled) > 0 else None
+
+                if timestamp is None:
+                    unknownTimestamp = True
+                elif oldestTimestamp is None or timestamp < oldestTimestamp:
+                    oldestTimestamp = timestamp
+
+        if totalMessages == 0:
+            return 0, 0
+        elif oldestTimestamp is None or unknownTimestamp:
+            return totalMessages, None
+        else:
+            return totalMessages, max(time.time() - oldestTimestamp / 1000.0, 0)
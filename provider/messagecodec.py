@@ -0,0 +1,144 @@
+"""MessageCodec classes.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import binascii
+import json
+import re
+
+from json.encoder import encode_basestring_ascii
+
+# The UTF-8 encoding of a UTF-16 surrogate. This is not valid UTF-8, but
+# Python 2's decoder accepts it.
+encoded_surrogate = re.compile('\xed[\xa0-\xbf][\x80-\xbf]')
+replacement_character = u'\ufffd'.encode('utf-8')
+
+
+# Encodes Kafka messages as the JSON objects that appear in a trigger payload.
+# The codec is chosen once per trigger by newMessageCodec, so that encoding a
+# message involves no per-message checks of the trigger's options. Values and
+# keys are dumped straight to JSON text, rather than building a dict for each
+# message and handing it to json.dumps.
+#
+# Each subclass provides dumpValue(value), which returns the JSON encoding of a
+# message's value.
+class MessageCodec:
+    template = '{{"value":{},"topic":{},"partition":{},"offset":{},"key":{}}}'
+
+    def __init__(self, encodeKeyAsBase64):
+        self.dumpKey = dumpBase64 if encodeKeyAsBase64 else dumpText
+
+    # returns the JSON encoding of each message, or None for those that carry
+    # an error rather than a message
+    def encodeBatch(self, messages):
+        format = self.template.format
+        dumpValue = self.dumpValue
+        dumpKey = self.dumpKey
+
+        return [None if message.error() else format(
+            dumpValue(message.value()),
+            encode_basestring_ascii(message.topic()),
+            message.partition(),
+            message.offset(),
+            dumpKey(message.key())
+        ) for message in messages]
+
+
+# passes the value through as text
+class RawCodec (MessageCodec):
+    def dumpValue(self, value):
+        return dumpText(value)
+
+
+# passes the value through as JSON if it is valid, or failing that as a quoted
+# string
+class JSONCodec (MessageCodec):
+    # Valid JSON is spliced into the payload exactly as it was received. It is
+    # parsed only to validate it, and the result is thrown away rather than
+    # serialized again. Values that are not valid UTF-8, including those that
+    # hold encoded surrogates, are decoded with replacement and tried once more.
+    def dumpValue(self, value):
+        if value is None:
+            return 'null'
+
+        try:
+            json.loads(value, parse_constant=errorOnJSONConstant, parse_float=parseFloat)
+
+            if encoded_surrogate.search(value) is None:
+                return value
+        except ValueError:
+            pass
+
+        text = encoded_surrogate.sub(replacement_character, value).decode('utf-8', 'replace')
+
+        try:
+            return json.dumps(json.loads(text, parse_constant=errorOnJSONConstant, parse_float=parseFloat))
+        except ValueError:
+            return encode_basestring_ascii(u'"{}"'.format(text))
+
+
+# encodes the value's bytes as base64
+class Base64Codec (MessageCodec):
+    def dumpValue(self, value):
+        return dumpBase64(value)
+
+
+def newMessageCodec(spec):
+    if spec.isJSONData:
+        return JSONCodec(spec.isBinaryKey)
+    elif spec.isBinaryValue:
+        return Base64Codec(spec.isBinaryKey)
+    else:
+        return RawCodec(spec.isBinaryKey)
+
+
+# the JSON string holding the UTF-8 text, with any invalid bytes replaced
+def dumpText(value):
+    if value is None:
+        return 'null'
+
+    try:
+        return encode_basestring_ascii(value)
+    except UnicodeDecodeError:
+        return encode_basestring_ascii(value.decode('utf-8', 'replace'))
+
+
+def dumpBase64(value):
+    if value is None:
+        return 'null'
+
+    # b2a_base64 does not break lines, and only adds a trailing newline. Its
+    # output never needs escaping.
+    return '"' + binascii.b2a_base64(value)[:-1] + '"'
+
+
+def errorOnJSONConstant(data):
+    raise(ValueError('Constant "{}" detected in JSON.'.format(data)))
+
+
+def parseFloat(data):
+    res = float(data)
+
+    if res == float('inf'):
+        raise(ValueError('Parsing float value "{}" would result in "Infinity".'.format(data)))
+
+    if res == float('-inf'):
+        raise(ValueError('Parsing float value "{}" would result in "-Infinity".'.format(data)))
+
+    return res
@@ -0,0 +1,296 @@
+"""Provider metrics.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import bisect
+import ctypes
+import json
+import logging
+import os
+import time
+
+from statetable import sharedArray
+from threading import Lock, Thread
+
+
+# A monotonically increasing count, optionally split by the values of a single
+# label. The label values must all be known up front; values that were not
+# declared are counted under otherValue, or ignored if there is none.
+class Counter:
+    def __init__(self, name, description, labelName=None, labelValues=None, otherValue=None):
+        self.name = name
+        self.description = description
+        self.labelName = labelName
+        self.labelValues = labelValues if labelValues is not None else [None]
+        self.indexes = dict((value, index) for index, value in enumerate(self.labelValues))
+        self.otherIndex = self.indexes.get(otherValue) if otherValue is not None else None
+        self.size = len(self.labelValues)
+
+    def inc(self, amount=1, labelValue=None, slot=None):
+        index = self.indexes.get(labelValue, self.otherIndex)
+
+        if index is not None:
+            self.registry.add(slot, self.offset + index, amount)
+
+    def exposition(self, values):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+
+        for index, labelValue in enumerate(self.labelValues):
+            value = values[self.offset + index]
+
+            if labelValue is None:
+                lines.append('{} {}'.format(self.name, formatValue(value)))
+            elif value > 0:
+                lines.append('{}{{{}="{}"}} {}'.format(self.name, self.labelName, labelValue, formatValue(value)))
+
+        return lines
+
+
+# Counts observations into fixed buckets. Each bucket is stored on its own, and
+# only made cumulative when exposed.
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # one slot per bucket, one for +Inf, then the sum and the count
+        self.size = len(buckets) + 3
+
+    def observe(self, value, slot=None):
+        bucket = bisect.bisect_left(self.buckets, value)
+        self.registry.observe(slot, self.offset + bucket, self.offset + len(self.buckets) + 1, value)
+
+    def exposition(self, values):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+
+        cumulative = 0
+        for index, bound in enumerate(self.buckets + [None]):
+            cumulative += values[self.offset + index]
+            le = '+Inf' if bound is None else formatValue(bound)
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, le, formatValue(cumulative)))
+
+        lines.append('{}_sum {}'.format(self.name, formatValue(values[self.offset + len(self.buckets) + 1])))
+        lines.append('{}_count {}'.format(self.name, formatValue(values[self.offset + len(self.buckets) + 2])))
+
+        return lines
+
+
+def formatValue(value):
+    if value == int(value):
+        return str(int(value))
+    else:
+        return repr(value)
+
+
+# Holds the values of a fixed set of metrics in anonymous shared memory, so that
+# every consumer process can update them and the main process can expose them
+# without asking anyone. Like the StateTable, the registry must be created
+# before any consumer processes are forked.
+#
+# There is one row of values for each slot of the state table, plus a row for
+# the main process. Each row is only ever written by the process that runs the
+# consumer owning the slot, so no lock is shared between processes, and a
+# consumer process that is killed cannot leave one held. The rows are summed
+# when the metrics are exposed. Threads within a process share a lock of their
+# own, which is replaced after a fork in case it was held at the time.
+class MetricsRegistry:
+    def __init__(self, metrics, slots):
+        self.metrics = metrics
+
+        offset = 0
+        for metric in metrics:
+            metric.registry = self
+            metric.offset = offset
+            offset += metric.size
+
+        self.width = offset
+        self.mainRow = slots
+        # only the pages of rows that are written to take up memory
+        self.values = sharedArray(ctypes.c_double, (slots + 1) * offset)
+        # rows that have ever been written to, so that exposition can skip the rest
+        self.used = sharedArray(ctypes.c_ubyte, slots + 1)
+
+        self.pid = os.getpid()
+        self.lock = Lock()
+
+    def __localLock(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.lock = Lock()
+
+        return self.lock
+
+    # the first value of the row that a slot writes to, or of the main row
+    def __base(self, slot):
+        row = self.mainRow if slot is None else slot
+        self.used[row] = 1
+        return row * self.width
+
+    def add(self, slot, index, amount):
+        with self.__localLock():
+            self.values[self.__base(slot) + index] += amount
+
+    # increments a histogram bucket and its count, and adds to its sum
+    def observe(self, slot, bucketIndex, sumIndex, value):
+        with self.__localLock():
+            base = self.__base(slot)
+            self.values[base + bucketIndex] += 1
+            self.values[base + sumIndex] += value
+            self.values[base + sumIndex + 1] += 1
+
+    # Moves the values of a slot into the main row, once nothing can write to
+    # the slot any more, so that a new owner of the slot starts from zero and
+    # the totals never go backwards. Must be called from the main process.
+    def retire(self, slot):
+        if not self.used[slot]:
+            return
+
+        with self.__localLock():
+            start = slot * self.width
+            mainStart = self.mainRow * self.width
+
+            for index in range(self.width):
+                self.values[mainStart + index] += self.values[start + index]
+
+            ctypes.memset(ctypes.addressof(self.values) + start * ctypes.sizeof(ctypes.c_double), 0, self.width * ctypes.sizeof(ctypes.c_double))
+            self.used[slot] = 0
+            self.used[self.mainRow] = 1
+
+    # returns all metrics in the Prometheus text exposition format
+    def exposition(self):
+        values = [0.0] * self.width
+
+        # retire() moves values between rows under this lock
+        with self.__localLock():
+            for row in range(self.mainRow + 1):
+                if self.used[row]:
+                    start = row * self.width
+                    values = map(float.__add__, values, self.values[start:start + self.width])
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.exposition(values))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Builds the exposition in the background every `interval` seconds, so that a
+# request to /metrics only has to return the latest one, rather than hold up
+# the web server while the rows of every consumer are summed.
+class MetricsSampler (Thread):
+    def __init__(self, registry, interval):
+        Thread.__init__(self)
+
+        self.daemon = True
+        self.registry = registry
+        self.interval = interval
+
+        self.sample()
+
+    def sample(self):
+        # replacing the reference is atomic, requests see one exposition or the other
+        self.exposition = self.registry.exposition()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error("[metrics] Uncaught exception while sampling: {}".format(e))
+
+
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+pollToFireSeconds = Histogram('kafka_trigger_poll_to_fire_seconds', 'Time from polling a batch of messages until the trigger was fired with it, including any retries.', latency_buckets)
+fireSeconds = Histogram('kafka_trigger_fire_seconds', 'Time taken by each HTTP request made to fire a trigger.', latency_buckets)
+batchMessages = Histogram('kafka_trigger_batch_messages', 'Number of messages in each batch fired.', [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000])
+batchBytes = Histogram('kafka_trigger_batch_bytes', 'Size of the payload of each batch fired, in bytes.', [1000, 10000, 50000, 100000, 250000, 500000, 750000, 1000000])
+fire_codes = ['200', '202', '204', '400', '401', '403', '404', '408', '409', '413', '429', '500', '502', '503', '504']
+
+fires = Counter('kafka_trigger_fires_total', 'HTTP requests made to fire a trigger, by response status code, "other" for any less common code, or "error" if there was no response.', 'code', fire_codes + ['other', 'error'], otherValue='other')
+fireRetries = Counter('kafka_trigger_fire_retries_total', 'Failed fires that have been scheduled to be retried.')
+skippedMessages = Counter('kafka_trigger_skipped_messages_total', 'Messages committed without having been fired, because they were too large or could not be fired after retrying.')
+spawnSeconds = Histogram('kafka_trigger_spawn_seconds', 'Time from the request to start a consumer process until it was running.', latency_buckets)
+canaryLatencySeconds = Histogram('kafka_trigger_canary_latency_seconds', 'Time from writing a canary document until it was seen on the changes feed.', latency_buckets)
+restarts = Counter('kafka_trigger_restarts_total', 'Consumers restarted by the doctor.')
+
+# one row for each slot of the state table in consumer.py
+registry = MetricsRegistry([pollToFireSeconds, fireSeconds, batchMessages, batchBytes, fires, fireRetries, skippedMessages, spawnSeconds, canaryLatencySeconds, restarts], int(os.getenv('STATE_TABLE_SIZE', 20000)))
+
+
+# Reduces the statistics JSON emitted by librdkafka to the handful of values
+# that are worth keeping for each trigger. Counters are cumulative since the
+# KafkaConsumer was created.
+def reduceKafkaStats(statsJSON):
+    stats = json.loads(statsJSON)
+
+    fetchQueueMessages = 0
+    fetchQueueBytes = 0
+    for topic in stats.get('topics', {}).values():
+        for partitionId, partition in topic.get('partitions', {}).items():
+            # partition -1 is the internal UA (unassigned) partition
+            if partitionId != '-1':
+                fetchQueueMessages += max(partition.get('fetchq_cnt', 0), 0)
+                fetchQueueBytes += max(partition.get('fetchq_size', 0), 0)
+
+    # the slowest broker, ignoring bootstrap brokers and any without samples
+    brokerRttSeconds = 0
+    for broker in stats.get('brokers', {}).values():
+        if broker.get('nodeid', -1) >= 0:
+            rtt = broker.get('rtt', {}).get('avg', 0) / 1000000.0
+            brokerRttSeconds = max(brokerRttSeconds, rtt)
+
+    return {
+        'fetchQueueMessages': fetchQueueMessages,
+        'fetchQueueBytes': fetchQueueBytes,
+        'brokerRttSeconds': brokerRttSeconds,
+        'rebalances': stats.get('cgrp', {}).get('rebalance_cnt', 0),
+        'rxBytes': stats.get('rx_bytes', 0),
+        'txBytes': stats.get('tx_bytes', 0)
+    }
+
+
+# Combines the reduced statistics of every consumer that has reported any
+def aggregateKafkaStats(consumers):
+    aggregate = {
+        'consumers': 0,
+        'fetchQueueMessages': 0,
+        'fetchQueueBytes': 0,
+        'maxBrokerRttSeconds': 0,
+        'rebalances': 0,
+        'rxBytes': 0,
+        'txBytes': 0
+    }
+
+    consumerCopyRO = consumers.getCopyForRead()
+    for consumerId in consumerCopyRO:
+        stats = consumerCopyRO[consumerId].kafkaStats()
+
+        if stats is not None:
+            aggregate['consumers'] += 1
+            aggregate['fetchQueueMessages'] += stats['fetchQueueMessages']
+            aggregate['fetchQueueBytes'] += stats['fetchQueueBytes']
+            aggregate['maxBrokerRttSeconds'] = max(aggregate['maxBrokerRttSeconds'], stats['brokerRttSeconds'])
+            aggregate['rebalances'] += stats['rebalances']
+            aggregate['rxBytes'] += stats['rxBytes']
+            aggregate['txBytes'] += stats['txBytes']
+
+    return aggregate
@@ -0,0 +1,58 @@
+"""PayloadBuilder class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+
+# Incrementally builds the JSON body used to fire a trigger, i.e.
+# {"messages":[...]}, from messages that have already been encoded as JSON.
+# Each message is encoded exactly once, and the size of the body is tracked
+# exactly so it can be kept within the payload limit.
+class PayloadBuilder:
+    prefix = '{"messages":['
+    suffix = ']}'
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.messages = []
+        self.encodedMessages = []
+        self.size = len(self.prefix) + len(self.suffix)
+
+    def __len__(self):
+        return len(self.messages)
+
+    # returns False, without adding the message, if it would cause the body to
+    # exceed the payload limit
+    def add(self, message, encodedMessage):
+        addedSize = len(encodedMessage)
+
+        if len(self.encodedMessages) > 0:
+            # account for the separating comma
+            addedSize += 1
+
+        if self.size + addedSize > self.limit:
+            return False
+
+        self.messages.append(message)
+        self.encodedMessages.append(encodedMessage)
+        self.size += addedSize
+
+        return True
+
+    def body(self):
+        return self.prefix + ','.join(self.encodedMessages) + self.suffix
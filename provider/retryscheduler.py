@@ -0,0 +1,67 @@
+"""RetryScheduler class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import heapq
+import itertools
+import random
+import time
+
+
+# Keeps track of when failed fires should be retried, without ever sleeping.
+# The owner asks for the tasks that are due on each trip around its loop.
+class RetryScheduler:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    # schedule the task to be retried after an exponential backoff with jitter
+    # based on the number of attempts made so far, returning the delay
+    def schedule(self, task):
+        backoff = pow(2, task.attempts)
+        delay = random.uniform(backoff / 2.0, backoff)
+        heapq.heappush(self.heap, (time.time() + delay, next(self.counter), task))
+
+        return delay
+
+    # remove and return the tasks that are due to be retried
+    def due(self):
+        now = time.time()
+        tasks = []
+
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            tasks.append(heapq.heappop(self.heap)[2])
+
+        return tasks
+
+    def secondsUntilNextDue(self):
+        if len(self.heap) == 0:
+            return None
+
+        return max(self.heap[0][0] - time.time(), 0)
+
+    # remove and return all scheduled tasks
+    def clear(self):
+        tasks = [entry[2] for entry in self.heap]
+        self.heap = []
+
+        return tasks
@@ -19,13 +19,17 @@
 """
 
 import logging
+import metrics
 import os
 import time
 
 from consumer import Consumer
+from consumerstarter import ConsumerStarter
 from database import Database
 from datetime import datetime
 from datetimeutils import secondsSince
+from statetable import StateTableFullException
+from triggerspec import TriggerSpec
 from requests.exceptions import ConnectionError, ReadTimeout
 from threading import Thread
 
@@ -35,6 +39,9 @@ canaryInterval = 60  # seconds
 # How long the changes feed should poll before timing out
 changesFeedTimeout = 30  # seconds
 
+# How often to check the running triggers against those assigned to this worker
+reconcileInterval = float(os.getenv('RECONCILE_INTERVAL', 300))  # seconds
+
 
 class Service (Thread):
     def __init__(self, consumers):
@@ -43,12 +50,18 @@ class Service (Thread):
 
         self.database = None
         self.lastSequence = None
+        self.nextReconcile = time.time() + reconcileInterval
+        # read by the health sampler, which may run before this thread has started
+        self.lastCanaryTime = datetime.now()
         self.canaryGenerator = CanaryDocumentGenerator()
 
         self.consumers = consumers
         self.workerId = os.getenv("WORKER", "worker0")
 
+        self.starter = ConsumerStarter(int(os.getenv('STARTUP_CONCURRENCY', 16)), float(os.getenv('MAX_STARTS_PER_SECOND', 10)))
+
     def run(self):
+        self.starter.start()
         self.canaryGenerator.start()
         self.lastCanaryTime = datetime.now()
 
@@ -60,6 +73,10 @@ class Service (Thread):
 
                 logging.info("Starting changes feed")
                 self.database = Database(timeout=changesFeedTimeout)
+
+                if self.lastSequence is None:
+                    self.lastSequence = self.__bootstrap()
+
                 self.changes = self.database.changesFeed(timeout=changesFeedTimeout, since=self.lastSequence)
 
                 for change in self.changes:
@@ -74,6 +91,9 @@ class Service (Thread):
                         # restarted. This way the new feed can pick up right where
                         # the old one left off.
                         self.lastSequence = change['seq']
+
+                    if time.time() >= self.nextReconcile:
+                        self.__reconcile()
             except Exception as e:
                 logging.error('[canary] Exception caught from changes feed. Restarting changes feed...')
                 logging.error(e)
@@ -81,6 +101,40 @@ class Service (Thread):
 
             logging.debug("[changes] I made it out of the changes loop!")
 
+    # Creates a consumer for every active trigger assigned to this worker, and
+    # returns the sequence from which the changes feed should be followed. This
+    # saves replaying the entire history of the database at startup.
+    def __bootstrap(self):
+        logging.info('[bootstrap] Loading active triggers assigned to {}'.format(self.workerId))
+        sequence, documents = self.database.activeTriggersForWorker(self.workerId)
+
+        for document in documents:
+            if not self.consumers.hasConsumerForTrigger(document['_id']):
+                self.createAndRunConsumer(document, bootstrapping=True)
+
+        logging.info('[bootstrap] Loaded {} triggers. Following changes from there.'.format(len(documents)))
+        return sequence
+
+    # The changes feed may coalesce several revisions of a document, so a
+    # trigger that was disabled and then reassigned can reach us only as an
+    # active trigger of another worker, which the feed's filter does not pass.
+    # Every so often, shut down any running consumer whose trigger is no longer
+    # active and assigned to this worker.
+    def __reconcile(self):
+        self.nextReconcile = time.time() + reconcileInterval
+
+        try:
+            # consumers created after the view is read may not be in it yet
+            consumers = self.consumers.getCopyForRead()
+            active = self.database.activeTriggerIdsForWorker(self.workerId)
+
+            for triggerFQN, consumer in consumers.items():
+                if triggerFQN not in active and consumer.desiredState() == Consumer.State.Running and self.consumers.getConsumerForTrigger(triggerFQN) is consumer:
+                    logging.info('[{}] Shutting down trigger as it is no longer active and assigned to {}'.format(triggerFQN, self.workerId))
+                    consumer.shutdown()
+        except Exception as e:
+            logging.error('[reconcile] Failed to check running triggers against the database: {}'.format(e))
+
     def __handleDocChange(self, change):
         retry = True
         retryCount = 0
@@ -99,8 +153,8 @@ class Service (Thread):
                         else:
                             logging.info('[{}] Shutting down running trigger'.format(consumer.trigger))
                             consumer.shutdown()
-                # since we can't use a filter function for the feed (then
-                # you don't get deletes) we need to manually verify this
+                # the feed's filter also passes canaries, and the disabled
+                # triggers of other workers, so we still need to verify this
                 # is a valid trigger doc that has changed
                 elif 'triggerURL' in change['doc']:
                     logging.info('[changes] Found a change in a trigger document')
@@ -129,9 +183,9 @@ class Service (Thread):
                                 # so we need to forcefully delete the process before recreating it.
                                 logging.info('[{}] A create event occurred for a trigger that is shutting down'.format(change["id"]))
 
-                                if existingConsumer.process.is_alive():
+                                if existingConsumer.isProcessAlive():
                                     logging.info('[{}] Joining dead process.'.format(existingConsumer.trigger))
-                                    existingConsumer.process.join(1)
+                                    existingConsumer.joinProcess(1)
                                 else:
                                     logging.info('[{}] Process is already dead.'.format(existingConsumer.trigger))
 
@@ -149,6 +203,10 @@ class Service (Thread):
                     # found a canary - update lastCanaryTime
                     logging.info('[canary] I found a canary. The last one was {} seconds ago.'.format(secondsSince(self.lastCanaryTime)))
                     self.lastCanaryTime = datetime.now()
+
+                    # only this instance's own canaries were timed by this clock
+                    if change['id'] == Database.canaryId and 'canary-time' in change['doc']:
+                        metrics.canaryLatencySeconds.observe(max(time.time() - change['doc']['canary-time'], 0))
                 else:
                     logging.debug('[changes] Found a change for a non-trigger document')
 
@@ -175,21 +233,39 @@ class Service (Thread):
             self.changes.stop()
             self.changes = None
 
-    def createAndRunConsumer(self, doc):
+    def createAndRunConsumer(self, doc, bootstrapping=False):
         triggerFQN = doc['_id']
 
         # Create a representation for this trigger, even if it is disabled
         # This allows it to appear in /health as well as allow it to be deleted
-        # Creating this object is lightweight and does not initialize any connections
-        consumer = Consumer(triggerFQN, doc)
+        # Creating this object is lightweight and does not initialize any connections,
+        # or anything else needed to run the trigger until it is started
+        try:
+            consumer = Consumer(TriggerSpec(doc))
+        except StateTableFullException as e:
+            # leave the rest of the triggers, and the changes feed, unaffected
+            logging.error('[{}] Not tracking trigger: {}. Set STATE_TABLE_SIZE to allow more triggers.'.format(triggerFQN, e))
+            return
+
         self.consumers.addConsumerForTrigger(triggerFQN, consumer)
 
         if self.__isTriggerDocActive(doc):
             logging.info('[{}] Trigger was determined to be active, starting...'.format(triggerFQN))
-            consumer.start()
+            self.starter.schedule(consumer, self.__startPriority(doc, bootstrapping))
         else:
             logging.info('[{}] Trigger was determined to be disabled, not starting...'.format(triggerFQN))
 
+    # Triggers that have just been created or enabled are started first, as
+    # someone is likely waiting on them. When bootstrapping, the triggers that
+    # changed most recently are started first, as they are the most likely to
+    # be in use.
+    def __startPriority(self, doc, bootstrapping):
+        if not bootstrapping:
+            return (0, 0)
+
+        dateChanged = doc['status'].get('dateChanged', 0) if 'status' in doc else 0
+        return (1, -dateChanged)
+
     def __isTriggerDocActive(self, doc):
         return ('status' not in doc or doc['status']['active'] == True)
 
@@ -0,0 +1,111 @@
+"""StateTable class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import ctypes
+import heapq
+import mmap
+
+from threading import Lock
+
+
+class StateTableFullException(Exception):
+    pass
+
+
+# Returns an array in anonymous shared memory, which processes forked after it
+# was created will share. Unlike RawArray, which zeroes the whole array up
+# front, this relies on the new mapping already being zero, so the pages of the
+# array are only allocated once they are first written to.
+def sharedArray(elementType, size):
+    arrayType = elementType * size
+    return arrayType.from_buffer(mmap.mmap(-1, ctypes.sizeof(arrayType)))
+
+
+# The fixed layout of a single consumer's slot in the table
+class ConsumerSlot (ctypes.Structure):
+    _fields_ = [
+        ('currentState', ctypes.c_ubyte),
+        ('desiredState', ctypes.c_ubyte),
+        ('lastPoll', ctypes.c_double),      # seconds since the epoch, 0 if never polled
+        ('loopCount', ctypes.c_ulonglong),
+        ('loopSeconds', ctypes.c_double),   # moving average of the time taken by one loop
+        ('idleWait', ctypes.c_double),      # how long the consumer currently waits for messages
+        ('fireCount', ctypes.c_ulonglong),
+        ('fireSeconds', ctypes.c_double),   # moving average of the time taken to fire the trigger
+        ('connections', ctypes.c_ulonglong), # connections opened to fire the trigger
+        ('lagSampled', ctypes.c_double),     # seconds since the epoch, 0 if lag was never measured
+        ('lagMessages', ctypes.c_ulonglong),
+        ('lagSeconds', ctypes.c_double),     # estimated lag in time, negative if unknown
+        ('statsSampled', ctypes.c_double),   # seconds since the epoch, 0 if no Kafka statistics were received
+        ('fetchQueueMessages', ctypes.c_ulonglong),
+        ('fetchQueueBytes', ctypes.c_ulonglong),
+        ('brokerRttSeconds', ctypes.c_double),
+        ('rebalances', ctypes.c_ulonglong),
+        ('rxBytes', ctypes.c_ulonglong),
+        ('txBytes', ctypes.c_ulonglong),
+        ('processState', ctypes.c_ubyte),   # only used for consumers forked by the ConsumerSpawner
+        ('pid', ctypes.c_int),
+        ('spawnSeconds', ctypes.c_double),  # from the request to start the consumer until it was running
+        ('rssBytes', ctypes.c_ulonglong),   # resident memory of the consumer's process
+        ('sharedBytes', ctypes.c_ulonglong), # the part of rssBytes shared with other processes
+        ('worker', ctypes.c_int)            # 1 + index of the ConsumerPool worker hosting the consumer, 0 if not pooled
+    ]
+
+
+# A fixed size table of consumer slots living in anonymous shared memory. The
+# table must be created before any consumer processes are forked so that they
+# all map the same pages. Reading or writing a slot is a plain memory access;
+# there is no lock and no round trip to another process.
+#
+# Slots are only allocated and released by the main process, and a slot must
+# not be released while a process that writes to it may still be running.
+#
+# The lowest free slot is always allocated first, so only as much of the table
+# as the largest number of consumers tracked at once is ever touched. The
+# rest of the table costs address space, but no memory.
+class StateTable:
+    def __init__(self, size):
+        self.size = size
+        self.slots = sharedArray(ConsumerSlot, size)
+        self.lock = Lock()
+
+        # a heap of the free slots, already ordered
+        self.free = range(size)
+
+    def allocate(self):
+        with self.lock:
+            if len(self.free) == 0:
+                raise StateTableFullException('All {} consumer state slots are in use'.format(self.size))
+
+            index = heapq.heappop(self.free)
+
+        self.clear(index)
+        return index
+
+    # zero every field of the slot
+    def clear(self, index):
+        ctypes.memset(ctypes.addressof(self.slots[index]), 0, ctypes.sizeof(ConsumerSlot))
+
+    def release(self, index):
+        with self.lock:
+            heapq.heappush(self.free, index)
+
+    def slot(self, index):
+        return self.slots[index]
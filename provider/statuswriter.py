@@ -0,0 +1,122 @@
+"""StatusWriter class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import logging
+import time
+
+from database import Database
+from Queue import Empty
+from threading import Thread
+
+
+# Writes the status updates requested by consumers to the database from the
+# main process, over a single database client. Consumers put
+# (triggerFQN, statusCode, dateChanged) on the queue rather than connecting to
+# the database themselves, and updates that arrive close together are written
+# in one _bulk_docs request. This way an incident that disables hundreds of
+# triggers at once costs a handful of requests, rather than a new session
+# per trigger.
+class StatusWriter (Thread):
+    # how long to wait for more updates to write with the first one
+    coalesce_seconds = 0.5
+    max_batch_size = 200
+
+    retry_base_seconds = 1
+    retry_max_seconds = 60
+
+    def __init__(self, updates):
+        Thread.__init__(self)
+
+        self.daemon = True
+        self.updates = updates
+        self.database = None
+        self.stopped = False
+
+        # triggerFQN -> (statusCode, dateChanged) waiting to be written
+        self.pending = dict()
+
+    # Stops once the updates already collected have been written, or have
+    # failed to be. The updates queue is woken with None.
+    def stop(self):
+        self.stopped = True
+        self.updates.put(None)
+
+    def run(self):
+        failures = 0
+
+        while not self.stopped:
+            try:
+                self.__collect()
+
+                # woken by stop() with nothing to write
+                if len(self.pending) == 0:
+                    continue
+
+                if self.database is None:
+                    self.database = Database()
+
+                # updates that conflict are left pending, to be fetched and
+                # written again with the next batch
+                pending = self.pending.items()
+
+                for start in range(0, len(pending), self.max_batch_size):
+                    batch = dict(pending[start:start + self.max_batch_size])
+                    conflicts = self.database.disableTriggers(batch)
+
+                    for triggerFQN in batch:
+                        if triggerFQN not in conflicts:
+                            del self.pending[triggerFQN]
+
+                failures = 0
+            except Exception as e:
+                logging.error('[database] Failed to write {} trigger status update(s): {}'.format(len(self.pending), e))
+                failures += 1
+
+                if self.database is not None:
+                    self.database.destroy()
+                    self.database = None
+
+                time.sleep(min(self.retry_base_seconds * pow(2, failures - 1), self.retry_max_seconds))
+
+    # wait for at least one update, unless some are still pending from a
+    # failed write, and then gather any others that arrive shortly after
+    def __collect(self):
+        if len(self.pending) == 0:
+            self.__add(self.updates.get())
+
+        deadline = time.time() + self.coalesce_seconds
+
+        while len(self.pending) < self.max_batch_size:
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                return
+
+            try:
+                self.__add(self.updates.get(timeout=remaining))
+            except Empty:
+                return
+
+    def __add(self, update):
+        if update is None:
+            return
+
+        triggerFQN, statusCode, dateChanged = update
+        self.pending[triggerFQN] = (statusCode, dateChanged)
@@ -0,0 +1,233 @@
+"""Unit tests for CommitCoalescer.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import unittest
+
+from commitcoalescer import CommitCoalescer
+
+
+class FakeMessage:
+    def __init__(self, topic, partition, offset):
+        self.__topic = topic
+        self.__partition = partition
+        self.__offset = offset
+
+    def topic(self):
+        return self.__topic
+
+    def partition(self):
+        return self.__partition
+
+    def offset(self):
+        return self.__offset
+
+
+# stands in for the TopicPartitions of a delivery report
+class FakePartition:
+    def __init__(self, topic, partition, offset, error=None):
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.error = error
+
+
+class FakeKafkaConsumer:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.commits = []
+
+    def commit(self, offsets, async):
+        if self.fail:
+            raise Exception('commit failed')
+
+        self.commits.append((sorted((p.topic, p.partition, p.offset) for p in offsets), async))
+        self.lastOffsets = offsets
+
+        if not async:
+            return offsets
+
+
+class CommitCoalescerTest(unittest.TestCase):
+    def testKeepsHighestOffsetForEachPartition(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5), FakeMessage('t', 0, 3), FakeMessage('t', 1, 7)])
+        coalescer.add([FakeMessage('t', 0, 4)])
+        coalescer.flush(consumer, async=False)
+
+        # the committed offset is that of the next message to consume
+        self.assertEqual(consumer.commits, [([('t', 0, 6), ('t', 1, 8)], False)])
+        self.assertEqual(coalescer.committed, {('t', 0): 6, ('t', 1): 8})
+
+    def testFlushWithNothingPendingDoesNotCommit(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.flush(consumer, async=False)
+
+        self.assertEqual(consumer.commits, [])
+
+    def testOffsetsAreOnlyCommittedOnce(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(consumer, async=True)
+        coalescer.flush(consumer, async=True)
+
+        self.assertEqual(len(consumer.commits), 1)
+
+    def testFailedCommitKeepsOffsets(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer(fail=True)
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        self.assertRaises(Exception, coalescer.flush, consumer, False)
+        self.assertEqual(coalescer.committed, {})
+
+        consumer.fail = False
+        coalescer.flush(consumer, async=False)
+
+        self.assertEqual(consumer.commits, [([('t', 0, 6)], False)])
+
+    def testFailedCommitDoesNotLowerNewerOffsets(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer(fail=True)
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        original = consumer.commit
+
+        # a higher offset is added while the failing commit is in progress
+        def commit(offsets, async):
+            coalescer.add([FakeMessage('t', 0, 9)])
+            original(offsets, async)
+
+        consumer.commit = commit
+        self.assertRaises(Exception, coalescer.flush, consumer, False)
+
+        consumer.commit = original
+        consumer.fail = False
+        coalescer.flush(consumer, async=False)
+
+        self.assertEqual(consumer.commits, [([('t', 0, 10)], False)])
+
+    def testFlushIfDueWaitsForTheInterval(self):
+        coalescer = CommitCoalescer('test', 60)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flushIfDue(consumer)
+        self.assertEqual(consumer.commits, [])
+
+        coalescer.lastFlush -= 60
+        coalescer.flushIfDue(consumer)
+        self.assertEqual(consumer.commits, [([('t', 0, 6)], True)])
+
+    def testFlushIfDueSwallowsCommitFailures(self):
+        coalescer = CommitCoalescer('test', 0)
+        consumer = FakeKafkaConsumer(fail=True)
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flushIfDue(consumer)
+
+        self.assertEqual(coalescer.offsets, {('t', 0): 6})
+
+    def testForgetClearsCommittedOffsets(self):
+        coalescer = CommitCoalescer('test', 1)
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(FakeKafkaConsumer(), async=False)
+        coalescer.forget([('t', 0)])
+
+        self.assertEqual(coalescer.committed, {})
+
+    def testForgetDropsPendingOffsetsOfRevokedPartitionsOnly(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5), FakeMessage('t', 1, 7)])
+        coalescer.forget([('t', 0)])
+        coalescer.flush(consumer, async=False)
+
+        self.assertEqual(consumer.commits, [([('t', 1, 8)], False)])
+
+    def testAsynchronousCommitIsOnlyRecordedOnceReported(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(consumer, async=True)
+        self.assertEqual(coalescer.committed, {})
+
+        coalescer.onCommit(None, consumer.lastOffsets)
+        self.assertEqual(coalescer.committed, {('t', 0): 6})
+
+    def testFailedAsynchronousCommitIsRetried(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(consumer, async=True)
+        coalescer.onCommit('timed out', consumer.lastOffsets)
+
+        self.assertEqual(coalescer.committed, {})
+        self.assertEqual(coalescer.offsets, {('t', 0): 6})
+
+    def testPartitionThatFailedToCommitIsRetried(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5), FakeMessage('t', 1, 7)])
+        coalescer.flush(consumer, async=True)
+
+        coalescer.onCommit(None, [FakePartition('t', 0, 6, error='timed out'), FakePartition('t', 1, 8)])
+
+        self.assertEqual(coalescer.committed, {('t', 1): 8})
+        self.assertEqual(coalescer.offsets, {('t', 0): 6})
+
+    def testFailureOfSupersededCommitIsIgnored(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(consumer, async=True)
+        first = consumer.lastOffsets
+
+        coalescer.add([FakeMessage('t', 0, 9)])
+        coalescer.flush(consumer, async=True)
+
+        coalescer.onCommit('timed out', first)
+        self.assertEqual(coalescer.offsets, {})
+
+    def testFailureAfterForgetIsIgnored(self):
+        coalescer = CommitCoalescer('test', 1)
+        consumer = FakeKafkaConsumer()
+
+        coalescer.add([FakeMessage('t', 0, 5)])
+        coalescer.flush(consumer, async=True)
+        coalescer.forget([('t', 0)])
+
+        coalescer.onCommit('timed out', consumer.lastOffsets)
+        self.assertEqual(coalescer.offsets, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
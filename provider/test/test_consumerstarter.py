@@ -0,0 +1,162 @@
+"""Unit tests for ConsumerStarter.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import time
+import unittest
+
+from consumer import Consumer
+from consumerstarter import ConsumerStarter
+from threading import Condition
+
+
+# Stands in for a Consumer. Each one stays Initializing once started, until the
+# test marks it as Running.
+class FakeConsumer:
+    def __init__(self, trigger, starts, desiredState=Consumer.State.Running):
+        self.trigger = trigger
+        self.starts = starts
+        self.state = Consumer.State.Initializing
+        self.desired = desiredState
+        self.abandoned = False
+
+    def desiredState(self):
+        return self.desired
+
+    def currentState(self):
+        return self.state
+
+    def start(self):
+        self.starts.record(self)
+
+    def abandon(self):
+        self.abandoned = True
+        self.starts.record(None)
+
+
+# the consumers in the order they were started, and when
+class Starts:
+    def __init__(self):
+        self.condition = Condition()
+        self.started = []
+
+    def record(self, consumer):
+        with self.condition:
+            self.started.append((time.time(), consumer))
+            self.condition.notify_all()
+
+    def waitFor(self, count, timeout=10):
+        deadline = time.time() + timeout
+
+        with self.condition:
+            while len(self.started) < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+
+            return len(self.started) >= count
+
+    def triggers(self):
+        with self.condition:
+            return [consumer.trigger if consumer is not None else None for started, consumer in self.started]
+
+
+class ConsumerStarterTest(unittest.TestCase):
+    def setUp(self):
+        self.starts = Starts()
+        self.starter = None
+
+    def tearDown(self):
+        if self.starter is not None:
+            self.starter.stop()
+            self.starter.join(10)
+
+    def newConsumer(self, trigger, desiredState=Consumer.State.Running):
+        return FakeConsumer(trigger, self.starts, desiredState)
+
+    def testConsumersAreStartedInOrderOfPriority(self):
+        self.starter = ConsumerStarter(10, 1000)
+
+        for trigger, priority in [('c', 2), ('a', 0), ('d', 2), ('b', 1)]:
+            self.starter.schedule(self.newConsumer(trigger), priority)
+
+        self.starter.start()
+
+        self.assertTrue(self.starts.waitFor(4))
+        self.assertEqual(self.starts.triggers(), ['a', 'b', 'c', 'd'])
+
+    def testStartsAreSpacedOutByTheRateLimit(self):
+        self.starter = ConsumerStarter(10, 20)
+
+        for trigger in ['a', 'b', 'c', 'd']:
+            self.starter.schedule(self.newConsumer(trigger), 0)
+
+        self.starter.start()
+
+        self.assertTrue(self.starts.waitFor(4))
+        times = [started for started, consumer in self.starts.started]
+
+        for earlier, later in zip(times, times[1:]):
+            self.assertGreaterEqual(later - earlier, 0.045)
+
+    def testConsumersConnectingAtOnceAreLimited(self):
+        self.starter = ConsumerStarter(1, 1000)
+        first = self.newConsumer('a')
+        self.starter.schedule(first, 0)
+        self.starter.schedule(self.newConsumer('b'), 0)
+        self.starter.start()
+
+        self.assertTrue(self.starts.waitFor(1))
+        self.assertFalse(self.starts.waitFor(2, timeout=0.3))
+
+        first.state = Consumer.State.Running
+        self.assertTrue(self.starts.waitFor(2))
+        self.assertEqual(self.starts.triggers(), ['a', 'b'])
+
+    def testConsumerThatNeverConnectsStopsCountingAfterTimeout(self):
+        self.starter = ConsumerStarter(1, 1000)
+        self.starter.connect_timeout_seconds = 0.2
+        self.starter.schedule(self.newConsumer('a'), 0)
+        self.starter.schedule(self.newConsumer('b'), 0)
+        self.starter.start()
+
+        self.assertTrue(self.starts.waitFor(2))
+        times = [started for started, consumer in self.starts.started]
+        self.assertGreaterEqual(times[1] - times[0], 0.2)
+
+    def testConsumerDisabledWhileWaitingIsAbandoned(self):
+        self.starter = ConsumerStarter(10, 1000)
+        disabled = self.newConsumer('a', Consumer.State.Disabled)
+        self.starter.schedule(disabled, 0)
+        self.starter.start()
+
+        self.assertTrue(self.starts.waitFor(1))
+        self.assertEqual(self.starts.triggers(), [None])
+        self.assertTrue(disabled.abandoned)
+
+    def testStopEndsTheThread(self):
+        starter = ConsumerStarter(10, 1000)
+        starter.start()
+
+        starter.stop()
+        starter.join(10)
+
+        self.assertFalse(starter.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
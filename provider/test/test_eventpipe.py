@@ -0,0 +1,92 @@
+"""Unit tests for EventPipe.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import os
+import signal
+import time
+import unittest
+
+from eventpipe import EventPipe
+from Queue import Empty
+
+
+class EventPipeTest(unittest.TestCase):
+    def testCarriesEventsInOrder(self):
+        pipe = EventPipe()
+
+        pipe.put('/ns/a')
+        pipe.put(('/ns/b', 502, 1234L))
+
+        self.assertEqual(pipe.get(timeout=1), '/ns/a')
+        self.assertEqual(pipe.get(timeout=1), ('/ns/b', 502, 1234L))
+
+    def testGetTimesOut(self):
+        self.assertRaises(Empty, EventPipe().get, timeout=0.01)
+
+    def testRefusesEventsTooLargeToWriteAtOnce(self):
+        self.assertRaises(ValueError, EventPipe().put, 'x' * 10000)
+
+    def testCarriesEventsFromForkedProcesses(self):
+        pipe = EventPipe()
+        pids = []
+
+        for index in range(4):
+            pid = os.fork()
+
+            if pid == 0:
+                for count in range(500):
+                    pipe.put((index, count))
+                os._exit(0)
+
+            pids.append(pid)
+
+        received = [pipe.get(timeout=5) for count in range(2000)]
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+        for index in range(4):
+            self.assertEqual([count for i, count in received if i == index], range(500))
+
+    def testProcessKilledWhilePuttingLeavesThePipeUsable(self):
+        pipe = EventPipe()
+        pid = os.fork()
+
+        if pid == 0:
+            while True:
+                pipe.put('killed')
+
+        # the child fills the pipe, and blocks, until events are read
+        self.assertEqual(pipe.get(timeout=5), 'killed')
+        time.sleep(0.1)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        pipe.put('after')
+
+        while True:
+            event = pipe.get(timeout=5)
+            if event != 'killed':
+                break
+
+        self.assertEqual(event, 'after')
+
+
+if __name__ == '__main__':
+    unittest.main()
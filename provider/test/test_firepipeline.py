@@ -0,0 +1,108 @@
+"""Unit tests for FirePipeline.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import unittest
+
+from firepipeline import FirePipeline, FireTask
+from threading import Event
+
+
+class FirePipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = None
+
+    def tearDown(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+            for thread in self.pipeline.threads:
+                thread.join(10)
+
+    def completed(self, count):
+        tasks = []
+
+        while len(tasks) < count:
+            completed = self.pipeline.completed(timeout=10)
+            self.assertNotEqual(completed, [])
+            tasks.extend(completed)
+
+        return tasks
+
+    def testCompletedTasksCarryTheirResult(self):
+        self.pipeline = FirePipeline('test', 2, lambda task: FireTask.Fired if task.body == 'good' else FireTask.Failed)
+
+        good = FireTask([], 'good')
+        bad = FireTask([], 'bad')
+        self.pipeline.submit(good)
+        self.pipeline.submit(bad)
+
+        self.assertEqual(sorted(self.completed(2)), sorted([good, bad]))
+        self.assertEqual(good.result, FireTask.Fired)
+        self.assertEqual(bad.result, FireTask.Failed)
+
+    def testTasksCompleteInAnyOrder(self):
+        release = Event()
+
+        def fire(task):
+            if task.body == 'slow':
+                release.wait(10)
+
+            return FireTask.Fired
+
+        self.pipeline = FirePipeline('test', 2, fire)
+
+        slow = FireTask([], 'slow')
+        fast = FireTask([], 'fast')
+        self.pipeline.submit(slow)
+        self.pipeline.submit(fast)
+
+        self.assertEqual(self.completed(1), [fast])
+
+        release.set()
+        self.assertEqual(self.completed(1), [slow])
+
+    def testExceptionFailsTheAttempt(self):
+        def fire(task):
+            raise Exception('no connection')
+
+        self.pipeline = FirePipeline('test', 1, fire)
+
+        task = FireTask([], 'body')
+        self.pipeline.submit(task)
+
+        self.assertEqual(self.completed(1), [task])
+        self.assertEqual(task.result, FireTask.Failed)
+
+    def testCompletedDoesNotBlockWithoutTimeout(self):
+        self.pipeline = FirePipeline('test', 1, lambda task: FireTask.Fired)
+
+        self.assertEqual(self.pipeline.completed(), [])
+
+    def testStopEndsTheThreads(self):
+        pipeline = FirePipeline('test', 3, lambda task: FireTask.Fired)
+        pipeline.stop()
+
+        for thread in pipeline.threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
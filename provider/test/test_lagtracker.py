@@ -0,0 +1,162 @@
+"""Unit tests for LagTracker.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import time
+import unittest
+
+from commitcoalescer import CommitCoalescer
+from confluent_kafka import TopicPartition, TIMESTAMP_CREATE_TIME, TIMESTAMP_NOT_AVAILABLE
+from lagtracker import LagTracker
+
+
+class FakeMessage:
+    def __init__(self, partition, offset, timestamp=None):
+        self.__partition = partition
+        self.__offset = offset
+        self.__timestamp = timestamp
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return 'topic'
+
+    def partition(self):
+        return self.__partition
+
+    def offset(self):
+        return self.__offset
+
+    def timestamp(self):
+        if self.__timestamp is None:
+            return TIMESTAMP_NOT_AVAILABLE, 0
+        else:
+            return TIMESTAMP_CREATE_TIME, self.__timestamp
+
+
+# stands in for the confluent_kafka Consumer, with the given high watermark
+# and position of each assigned partition
+class FakeKafkaConsumer:
+    def __init__(self, highWatermarks, positions={}):
+        self.highWatermarks = highWatermarks
+        self.positions = positions
+
+    def assignment(self):
+        return [TopicPartition('topic', partition) for partition in sorted(self.highWatermarks)]
+
+    def position(self, partitions):
+        return [TopicPartition('topic', p.partition, self.positions.get(p.partition, -1001)) for p in partitions]
+
+    def get_watermark_offsets(self, partition, cached):
+        return 0, self.highWatermarks[partition.partition]
+
+
+class FakeSharedState:
+    def recordLag(self, messages, seconds):
+        self.lag = (messages, seconds)
+
+
+class LagTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.sharedState = FakeSharedState()
+        self.tracker = LagTracker('test', 0, self.sharedState)
+        self.commits = CommitCoalescer('test', 1)
+
+    def commit(self, partition, offset):
+        self.commits.committed[('topic', partition)] = offset
+
+    def testNothingAssignedHasNoLag(self):
+        self.tracker.sampleIfDue(FakeKafkaConsumer({}), self.commits)
+
+        self.assertEqual(self.sharedState.lag, (0, 0))
+
+    def testLagIsMeasuredFromTheCommittedOffset(self):
+        self.commit(0, 90)
+        self.commit(1, 45)
+
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 100, 1: 50}), self.commits)
+
+        # nothing has been polled, so the age of the oldest message is unknown
+        self.assertEqual(self.sharedState.lag, (15, None))
+
+    def testLagInSecondsComesFromTheOldestUncommittedMessage(self):
+        now = time.time() * 1000
+        self.commit(0, 90)
+        self.commit(1, 45)
+
+        self.tracker.observe([FakeMessage(0, 90, now - 5000), FakeMessage(0, 91, now - 4000)], self.commits)
+        self.tracker.observe([FakeMessage(1, 45, now - 20000)], self.commits)
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 100, 1: 50}), self.commits)
+
+        messages, seconds = self.sharedState.lag
+        self.assertEqual(messages, 15)
+        self.assertAlmostEqual(seconds, 20, delta=1)
+
+    def testCommittedPollsNoLongerCount(self):
+        now = time.time() * 1000
+
+        self.tracker.observe([FakeMessage(0, 10, now - 60000)], self.commits)
+        self.tracker.observe([FakeMessage(0, 11, now - 2000)], self.commits)
+        self.commit(0, 11)
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 12}), self.commits)
+
+        messages, seconds = self.sharedState.lag
+        self.assertEqual(messages, 1)
+        self.assertAlmostEqual(seconds, 2, delta=1)
+
+    def testPolledOffsetIsUsedBeforeAnythingIsCommitted(self):
+        self.tracker.observe([FakeMessage(0, 40)], self.commits)
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 50}, {0: 41}), self.commits)
+
+        self.assertEqual(self.sharedState.lag, (10, None))
+
+    def testPositionIsUsedBeforeAnythingIsPolled(self):
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 50}, {0: 30}), self.commits)
+
+        self.assertEqual(self.sharedState.lag, (20, None))
+
+    def testCaughtUpHasNoLag(self):
+        self.commit(0, 100)
+
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 100}), self.commits)
+
+        self.assertEqual(self.sharedState.lag, (0, 0))
+
+    def testForgetDropsWhatWasPolled(self):
+        now = time.time() * 1000
+
+        self.tracker.observe([FakeMessage(0, 40, now - 60000)], self.commits)
+        self.tracker.forget()
+        self.tracker.sampleIfDue(FakeKafkaConsumer({0: 50}, {0: 45}), self.commits)
+
+        self.assertEqual(self.sharedState.lag, (5, None))
+
+    def testSamplesAreTakenOncePerInterval(self):
+        tracker = LagTracker('test', 60, self.sharedState)
+
+        tracker.sampleIfDue(FakeKafkaConsumer({}), self.commits)
+        self.sharedState.lag = None
+        tracker.sampleIfDue(FakeKafkaConsumer({}), self.commits)
+
+        self.assertIsNone(self.sharedState.lag)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Unit tests for the message codecs.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import json
+import unittest
+
+from messagecodec import Base64Codec, JSONCodec, RawCodec, newMessageCodec
+from triggerspec import TriggerSpec
+
+
+class FakeMessage:
+    def __init__(self, value, key=None, error=None):
+        self.__value = value
+        self.__key = key
+        self.__error = error
+
+    def value(self):
+        return self.__value
+
+    def key(self):
+        return self.__key
+
+    def topic(self):
+        return 'topic'
+
+    def partition(self):
+        return 2
+
+    def offset(self):
+        return 17
+
+    def error(self):
+        return self.__error
+
+
+def encode(codec, value, key=None):
+    return codec.encodeBatch([FakeMessage(value, key)])[0]
+
+
+class MessageCodecTest(unittest.TestCase):
+    def testEncodesWholeMessage(self):
+        self.assertEqual(encode(RawCodec(False), 'hello', 'k'), '{"value":"hello","topic":"topic","partition":2,"offset":17,"key":"k"}')
+
+    def testNullValueAndKey(self):
+        for codec in [RawCodec(False), JSONCodec(False), Base64Codec(True)]:
+            self.assertEqual(encode(codec, None), '{"value":null,"topic":"topic","partition":2,"offset":17,"key":null}')
+
+    def testMessagesWithErrorsAreSkipped(self):
+        messages = [FakeMessage('a'), FakeMessage(None, error='partition EOF'), FakeMessage('b')]
+        encoded = RawCodec(False).encodeBatch(messages)
+
+        self.assertEqual(encoded[1], None)
+        self.assertEqual([json.loads(e)['value'] for e in encoded if e is not None], ['a', 'b'])
+
+    def testBinaryKey(self):
+        self.assertEqual(encode(RawCodec(True), 'v', '\x00\xff'), '{"value":"v","topic":"topic","partition":2,"offset":17,"key":"AP8="}')
+
+    def testNewMessageCodec(self):
+        document = {
+            '_id': '/ns/trigger',
+            'uuid': 'uuid',
+            'triggerURL': 'https://localhost',
+            'isMessageHub': False,
+            'brokers': ['localhost:9092'],
+            'topic': 'topic'
+        }
+
+        self.assertIsInstance(newMessageCodec(TriggerSpec(document)), RawCodec)
+        self.assertIsInstance(newMessageCodec(TriggerSpec(dict(document, isBinaryValue=True))), Base64Codec)
+        self.assertIsInstance(newMessageCodec(TriggerSpec(dict(document, isJSONData=True, isBinaryValue=True))), JSONCodec)
+
+
+class RawCodecTest(unittest.TestCase):
+    def testEscapesText(self):
+        self.assertEqual(RawCodec(False).dumpValue('say "hi"\n'), '"say \\"hi\\"\\n"')
+
+    def testNonASCIIText(self):
+        self.assertEqual(RawCodec(False).dumpValue('caf\xc3\xa9'), '"caf\\u00e9"')
+
+    def testInvalidUTF8IsReplaced(self):
+        self.assertEqual(RawCodec(False).dumpValue('caf\xc3\xa9\xff'), '"caf\\u00e9\\ufffd"')
+
+
+class Base64CodecTest(unittest.TestCase):
+    def testEncodesBytes(self):
+        self.assertEqual(Base64Codec(False).dumpValue('\x00\xff'), '"AP8="')
+
+    def testLongValuesAreNotWrapped(self):
+        self.assertEqual(Base64Codec(False).dumpValue('x' * 100), '"' + 'eHh4' * 33 + 'eA=="')
+
+
+class JSONCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = JSONCodec(False)
+
+    def testValidJSONIsSplicedUnchanged(self):
+        for value in ['  {"a" : [1, 2.50]} ', '"x"', '17', 'true', '{"a": 1.5e308}', '"caf\xc3\xa9"', '"\xf0\x9f\x98\x80"']:
+            self.assertEqual(self.codec.dumpValue(value), value)
+
+    def testPayloadWithSplicedValueIsValidJSON(self):
+        encoded = encode(self.codec, '{"a" : [1, 2.50]}')
+
+        self.assertEqual(encoded, '{"value":{"a" : [1, 2.50]},"topic":"topic","partition":2,"offset":17,"key":null}')
+        self.assertEqual(json.loads(encoded)['value'], {'a': [1, 2.5]})
+
+    def testInvalidJSONIsQuoted(self):
+        self.assertEqual(self.codec.dumpValue('not json'), '"\\"not json\\""')
+        self.assertEqual(self.codec.dumpValue('caf\xc3\xa9'), '"\\"caf\\u00e9\\""')
+        self.assertEqual(self.codec.dumpValue(''), '"\\"\\""')
+
+    def testNaNIsNotJSON(self):
+        self.assertEqual(self.codec.dumpValue('NaN'), '"\\"NaN\\""')
+        self.assertEqual(self.codec.dumpValue('{"a": NaN}'), '"\\"{\\"a\\": NaN}\\""')
+
+    def testInfinityIsNotJSON(self):
+        self.assertEqual(self.codec.dumpValue('Infinity'), '"\\"Infinity\\""')
+        self.assertEqual(self.codec.dumpValue('-Infinity'), '"\\"-Infinity\\""')
+
+    def testFloatsThatOverflowAreNotJSON(self):
+        self.assertEqual(self.codec.dumpValue('1e999'), '"\\"1e999\\""')
+        self.assertEqual(self.codec.dumpValue('-1e999'), '"\\"-1e999\\""')
+
+    def testInvalidUTF8IsReplacedBeforeParsing(self):
+        self.assertEqual(self.codec.dumpValue('{"a":"\xff"}'), '{"a": "\\ufffd"}')
+
+    def testInvalidUTF8ThatIsNotJSONIsQuoted(self):
+        self.assertEqual(self.codec.dumpValue('\xff{"a":1}'), '"\\"\\ufffd{\\"a\\":1}\\""')
+
+    def testEncodedSurrogatesAreReplaced(self):
+        # Python 2's decoder accepts these, but they are not valid UTF-8
+        self.assertEqual(self.codec.dumpValue('"\xed\xa0\x80"'), '"\\ufffd"')
+        self.assertEqual(self.codec.dumpValue('{"a":"x\xed\xbf\xbfy"}'), '{"a": "x\\ufffdy"}')
+        self.assertEqual(self.codec.dumpValue('\xed\xa0\x80abc'), '"\\"\\ufffdabc\\""')
+
+    def testCharactersNextToTheSurrogatesAreSpliced(self):
+        for value in ['"\xed\x9f\xbf"', '"\xee\x80\x80"']:
+            self.assertEqual(self.codec.dumpValue(value), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
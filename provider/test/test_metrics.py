@@ -0,0 +1,148 @@
+"""Unit tests for the MetricsRegistry.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import json
+import os
+import unittest
+
+from metrics import Counter, Histogram, MetricsRegistry, MetricsSampler, reduceKafkaStats
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.fires = Counter('fires_total', 'Fires.', 'code', ['200', 'other', 'error'], otherValue='other')
+        self.restarts = Counter('restarts_total', 'Restarts.')
+        self.seconds = Histogram('seconds', 'Seconds.', [1, 10])
+        self.registry = MetricsRegistry([self.fires, self.restarts, self.seconds], 4)
+
+    def lines(self):
+        return [line for line in self.registry.exposition().splitlines() if not line.startswith('#')]
+
+    def testSumsSlotsAndMainRow(self):
+        self.fires.inc(labelValue='200', slot=0)
+        self.fires.inc(labelValue='200', slot=3)
+        self.fires.inc(2, labelValue='error', slot=3)
+        self.restarts.inc()
+
+        self.assertEqual(self.lines()[:3], ['fires_total{code="200"} 2', 'fires_total{code="error"} 2', 'restarts_total 1'])
+
+    def testUndeclaredLabelValuesCountAsOther(self):
+        self.fires.inc(labelValue='418', slot=1)
+
+        self.assertIn('fires_total{code="other"} 1', self.lines())
+
+    def testHistogramBucketsAreCumulative(self):
+        self.seconds.observe(0.5, slot=1)
+        self.seconds.observe(5, slot=2)
+        self.seconds.observe(50)
+
+        self.assertEqual(self.lines()[-5:], [
+            'seconds_bucket{le="1"} 1',
+            'seconds_bucket{le="10"} 2',
+            'seconds_bucket{le="+Inf"} 3',
+            'seconds_sum 55.5',
+            'seconds_count 3'
+        ])
+
+    def testRetiredSlotsKeepTheirTotals(self):
+        self.restarts.inc(slot=2)
+        self.restarts.inc(slot=2)
+        before = self.lines()
+
+        self.registry.retire(2)
+
+        self.assertEqual(self.lines(), before)
+        self.assertEqual(self.registry.used[2], 0)
+        self.assertEqual(list(self.registry.values[2 * self.registry.width:3 * self.registry.width]), [0] * self.registry.width)
+
+    def testSlotsAreWrittenByForkedProcesses(self):
+        pid = os.fork()
+
+        if pid == 0:
+            self.restarts.inc(slot=1)
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        self.assertIn('restarts_total 1', self.lines())
+
+    def testSamplerServesTheLastExposition(self):
+        sampler = MetricsSampler(self.registry, 60)
+        self.restarts.inc()
+
+        self.assertIn('restarts_total 0', sampler.exposition)
+
+        sampler.sample()
+        self.assertIn('restarts_total 1', sampler.exposition)
+
+
+class ReduceKafkaStatsTest(unittest.TestCase):
+    def testReducesTheStatistics(self):
+        stats = reduceKafkaStats(json.dumps({
+            'rx_bytes': 5000,
+            'tx_bytes': 300,
+            'cgrp': {'rebalance_cnt': 2},
+            'topics': {
+                'topic': {
+                    'partitions': {
+                        '0': {'fetchq_cnt': 10, 'fetchq_size': 1000},
+                        '1': {'fetchq_cnt': 5, 'fetchq_size': 500},
+                        # the internal UA partition
+                        '-1': {'fetchq_cnt': 100, 'fetchq_size': 10000}
+                    }
+                }
+            },
+            'brokers': {
+                'bootstrap': {'nodeid': -1, 'rtt': {'avg': 900000}},
+                'broker1': {'nodeid': 1, 'rtt': {'avg': 20000}},
+                'broker2': {'nodeid': 2, 'rtt': {'avg': 50000}}
+            }
+        }))
+
+        self.assertEqual(stats, {
+            'fetchQueueMessages': 15,
+            'fetchQueueBytes': 1500,
+            'brokerRttSeconds': 0.05,
+            'rebalances': 2,
+            'rxBytes': 5000,
+            'txBytes': 300
+        })
+
+    def testNegativeQueueSizesAreIgnored(self):
+        stats = reduceKafkaStats(json.dumps({
+            'topics': {'topic': {'partitions': {'0': {'fetchq_cnt': -1, 'fetchq_size': -1}}}}
+        }))
+
+        self.assertEqual(stats['fetchQueueMessages'], 0)
+        self.assertEqual(stats['fetchQueueBytes'], 0)
+
+    def testMissingSectionsCountAsZero(self):
+        self.assertEqual(reduceKafkaStats('{}'), {
+            'fetchQueueMessages': 0,
+            'fetchQueueBytes': 0,
+            'brokerRttSeconds': 0,
+            'rebalances': 0,
+            'rxBytes': 0,
+            'txBytes': 0
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
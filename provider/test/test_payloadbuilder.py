@@ -0,0 +1,73 @@
+"""Unit tests for PayloadBuilder.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import json
+import unittest
+
+from payloadbuilder import PayloadBuilder
+
+
+class PayloadBuilderTest(unittest.TestCase):
+    def testEmptyBody(self):
+        builder = PayloadBuilder(100)
+
+        self.assertEqual(len(builder), 0)
+        self.assertEqual(builder.body(), '{"messages":[]}')
+        self.assertEqual(builder.size, len(builder.body()))
+
+    def testBodyJoinsEncodedMessages(self):
+        builder = PayloadBuilder(1000)
+
+        self.assertTrue(builder.add('first', '{"value":1}'))
+        self.assertTrue(builder.add('second', '{"value":"two"}'))
+
+        self.assertEqual(len(builder), 2)
+        self.assertEqual(builder.messages, ['first', 'second'])
+        self.assertEqual(builder.body(), '{"messages":[{"value":1},{"value":"two"}]}')
+        self.assertEqual(json.loads(builder.body()), {'messages': [{'value': 1}, {'value': 'two'}]})
+
+    def testSizeIsExact(self):
+        builder = PayloadBuilder(1000)
+
+        for index in range(5):
+            builder.add(index, '{{"value":{}}}'.format(index))
+            self.assertEqual(builder.size, len(builder.body()))
+
+    def testMessageThatFillsTheLimitIsAdded(self):
+        encoded = '{"value":1}'
+        builder = PayloadBuilder(len('{"messages":[]}') + len(encoded))
+
+        self.assertTrue(builder.add('message', encoded))
+        self.assertEqual(len(builder.body()), builder.limit)
+
+    def testMessageOverTheLimitIsRefused(self):
+        encoded = '{"value":1}'
+        builder = PayloadBuilder(len('{"messages":[]}') + len(encoded) * 2)
+
+        self.assertTrue(builder.add('first', encoded))
+        # the separating comma takes the second message over the limit
+        self.assertFalse(builder.add('second', encoded))
+
+        self.assertEqual(builder.messages, ['first'])
+        self.assertEqual(builder.body(), '{"messages":[{"value":1}]}')
+
+
+if __name__ == '__main__':
+    unittest.main()
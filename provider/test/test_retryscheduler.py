@@ -0,0 +1,121 @@
+"""Unit tests for RetryScheduler.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import random
+import retryscheduler
+import time
+import unittest
+
+from firepipeline import FireTask
+from retryscheduler import RetryScheduler
+
+
+# stands in for the time module, so that the tests decide when retries are due
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+# always picks the longest delay allowed
+class FakeRandom:
+    def uniform(self, low, high):
+        return high
+
+
+def newTask(attempts):
+    task = FireTask([], 'body')
+    task.attempts = attempts
+    return task
+
+
+class RetrySchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        retryscheduler.time = self.clock
+        self.scheduler = RetryScheduler()
+
+    def tearDown(self):
+        retryscheduler.time = time
+        retryscheduler.random = random
+
+    def testDelayBacksOffExponentiallyWithJitter(self):
+        for attempts in range(1, 7):
+            delay = self.scheduler.schedule(newTask(attempts))
+
+            self.assertTrue(pow(2, attempts) / 2.0 <= delay <= pow(2, attempts))
+
+    def testTasksAreOnlyDueOnceTheirDelayHasPassed(self):
+        task = newTask(1)
+        delay = self.scheduler.schedule(task)
+
+        self.assertEqual(self.scheduler.due(), [])
+        self.assertAlmostEqual(self.scheduler.secondsUntilNextDue(), delay)
+
+        self.clock.now += delay
+        self.assertEqual(self.scheduler.due(), [task])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def testTasksAreDueInOrderOfTheirDelay(self):
+        retryscheduler.random = FakeRandom()
+        later = newTask(3)
+        sooner = newTask(1)
+        self.scheduler.schedule(later)
+        self.scheduler.schedule(sooner)
+
+        self.clock.now += 2
+        self.assertEqual(self.scheduler.due(), [sooner])
+
+        self.clock.now += 6
+        self.assertEqual(self.scheduler.due(), [later])
+
+    def testTasksWithTheSameDelayAreDueInOrderOfScheduling(self):
+        retryscheduler.random = FakeRandom()
+        tasks = [newTask(2) for index in range(5)]
+
+        for task in tasks:
+            self.scheduler.schedule(task)
+
+        self.clock.now += 4
+        self.assertEqual(self.scheduler.due(), tasks)
+
+    def testSecondsUntilNextDue(self):
+        self.assertIsNone(self.scheduler.secondsUntilNextDue())
+
+        self.scheduler.schedule(newTask(1))
+        self.clock.now += 10
+
+        self.assertEqual(self.scheduler.secondsUntilNextDue(), 0)
+
+    def testClearReturnsEveryTask(self):
+        tasks = [newTask(1), newTask(4)]
+
+        for task in tasks:
+            self.scheduler.schedule(task)
+
+        self.assertEqual(sorted(self.scheduler.clear()), sorted(tasks))
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertIsNone(self.scheduler.secondsUntilNextDue())
+
+
+if __name__ == '__main__':
+    unittest.main()
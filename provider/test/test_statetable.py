@@ -0,0 +1,66 @@
+"""Unit tests for StateTable.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import os
+import unittest
+
+from statetable import StateTable, StateTableFullException
+
+
+class StateTableTest(unittest.TestCase):
+    def testAllocatesLowestFreeSlot(self):
+        table = StateTable(3)
+
+        self.assertEqual([table.allocate() for count in range(3)], [0, 1, 2])
+
+        table.release(2)
+        table.release(0)
+        self.assertEqual(table.allocate(), 0)
+        self.assertEqual(table.allocate(), 2)
+
+    def testFullTableRaises(self):
+        table = StateTable(1)
+        table.allocate()
+
+        self.assertRaises(StateTableFullException, table.allocate)
+
+    def testAllocatedSlotsAreCleared(self):
+        table = StateTable(1)
+        index = table.allocate()
+        table.slot(index).fireCount = 7
+        table.release(index)
+
+        self.assertEqual(table.slot(table.allocate()).fireCount, 0)
+
+    def testSlotsAreSharedWithForkedProcesses(self):
+        table = StateTable(2)
+        index = table.allocate()
+        pid = os.fork()
+
+        if pid == 0:
+            table.slot(index).pid = 1234
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+        self.assertEqual(table.slot(index).pid, 1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
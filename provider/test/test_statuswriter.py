@@ -0,0 +1,164 @@
+"""Unit tests for StatusWriter.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import os
+import time
+import unittest
+
+# the Database reads its settings when imported, but is never connected to
+for name in ['DB_USER', 'DB_PASS', 'DB_URL']:
+    os.environ.setdefault(name, 'unused')
+
+import statuswriter
+
+from Queue import Queue
+from statuswriter import StatusWriter
+from threading import Condition
+
+
+# Stands in for the Database, recording each batch written. The write fails
+# while `failures` remain, and the triggers given by each entry of `conflicts`
+# conflict with the write of the same index.
+class FakeDatabase:
+    def __init__(self, conflicts=[], failures=0):
+        self.conflicts = conflicts
+        self.failures = failures
+        self.batches = []
+        self.clients = 0
+        self.destroyed = 0
+        self.condition = Condition()
+
+    # called in place of the Database constructor
+    def newClient(self):
+        self.clients += 1
+        return self
+
+    def disableTriggers(self, updates):
+        with self.condition:
+            self.batches.append(dict(updates))
+            self.condition.notify_all()
+            index = len(self.batches) - 1
+
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception('connection refused')
+
+        return set(self.conflicts[index]) if index < len(self.conflicts) else set()
+
+    def destroy(self):
+        self.destroyed += 1
+
+    def waitForBatches(self, count):
+        deadline = time.time() + 10
+
+        with self.condition:
+            while len(self.batches) < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+
+
+class StatusWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = Queue()
+        self.writer = None
+
+    def tearDown(self):
+        statuswriter.Database = self.originalDatabase
+
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer.join(10)
+
+    def newWriter(self, database):
+        self.originalDatabase = statuswriter.Database
+        statuswriter.Database = database.newClient
+
+        self.writer = StatusWriter(self.updates)
+        self.writer.coalesce_seconds = 0.05
+        self.writer.retry_base_seconds = 0.01
+
+        return self.writer
+
+    def testUpdatesThatArriveTogetherAreWrittenTogether(self):
+        database = FakeDatabase()
+        writer = self.newWriter(database)
+
+        for trigger in ['a', 'b', 'c']:
+            self.updates.put((trigger, 403, 1000))
+
+        writer.start()
+        database.waitForBatches(1)
+
+        self.assertEqual(database.batches, [{'a': (403, 1000), 'b': (403, 1000), 'c': (403, 1000)}])
+
+    def testLaterUpdateOfTheSameTriggerWins(self):
+        database = FakeDatabase()
+        writer = self.newWriter(database)
+
+        self.updates.put(('a', 403, 1000))
+        self.updates.put(('a', 404, 2000))
+
+        writer.start()
+        database.waitForBatches(1)
+
+        self.assertEqual(database.batches, [{'a': (404, 2000)}])
+
+    def testConflictingUpdatesAreWrittenAgain(self):
+        database = FakeDatabase(conflicts=[['a']])
+        writer = self.newWriter(database)
+
+        self.updates.put(('a', 403, 1000))
+        self.updates.put(('b', 403, 1000))
+
+        writer.start()
+        database.waitForBatches(2)
+        writer.stop()
+        writer.join(10)
+
+        self.assertEqual(database.batches, [{'a': (403, 1000), 'b': (403, 1000)}, {'a': (403, 1000)}])
+
+    def testFailedWriteIsRetriedWithANewClient(self):
+        database = FakeDatabase(failures=1)
+        writer = self.newWriter(database)
+
+        self.updates.put(('a', 403, 1000))
+
+        writer.start()
+        database.waitForBatches(2)
+
+        self.assertEqual(database.batches, [{'a': (403, 1000)}, {'a': (403, 1000)}])
+        self.assertEqual(database.destroyed, 1)
+        self.assertEqual(database.clients, 2)
+
+    def testBatchesAreLimitedInSize(self):
+        database = FakeDatabase()
+        writer = self.newWriter(database)
+        writer.max_batch_size = 2
+
+        for trigger in ['a', 'b', 'c']:
+            self.updates.put((trigger, 403, 1000))
+
+        writer.start()
+        database.waitForBatches(2)
+
+        self.assertEqual([len(batch) for batch in database.batches], [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+"""Unit tests for TheDoctor.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import time
+import unittest
+
+import thedoctor
+
+from consumer import Consumer, consumerExits
+from consumercollection import ConsumerCollection
+from thedoctor import TheDoctor
+
+
+# stands in for the time module, so that the tests decide when deadlines pass
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeConsumer:
+    def __init__(self, trigger, clock):
+        self.trigger = trigger
+        self.clock = clock
+        self.current = Consumer.State.Running
+        self.desired = Consumer.State.Running
+        self.lastPollTime = clock.now
+        self.restarts = 0
+
+    def currentState(self):
+        return self.current
+
+    def desiredState(self):
+        return self.desired
+
+    def secondsSinceLastPoll(self):
+        return self.clock.now - self.lastPollTime
+
+    def isProcessAlive(self):
+        return False
+
+    def joinProcess(self, timeout):
+        pass
+
+    def releaseState(self):
+        pass
+
+    def restartCount(self):
+        return 0
+
+    def restart(self):
+        self.restarts += 1
+        return True
+
+
+# counts how many times the Doctor has examined each trigger, as it looks up
+# the consumer first thing every time
+class WatchedCollection (ConsumerCollection):
+    def __init__(self):
+        ConsumerCollection.__init__(self)
+        self.examinations = dict()
+
+    def getConsumerForTrigger(self, triggerFQN):
+        self.examinations[triggerFQN] = self.examinations.get(triggerFQN, 0) + 1
+        return ConsumerCollection.getConsumerForTrigger(self, triggerFQN)
+
+
+class TheDoctorTest(unittest.TestCase):
+    def setUp(self):
+        self.realTime = thedoctor.time
+        self.clock = FakeClock()
+        thedoctor.time = self.clock
+
+        self.collection = WatchedCollection()
+        self.doctor = TheDoctor(self.collection)
+        # don't wait long for exits, as the deadlines are on the fake clock
+        self.doctor.sleepy_time_seconds = 0.01
+        self.doctor.start()
+
+    def tearDown(self):
+        self.doctor.stop()
+        self.doctor.join(10)
+
+        for thread in self.doctor.restarter.threads:
+            thread.join(10)
+
+        thedoctor.time = self.realTime
+
+    def addConsumer(self, trigger):
+        consumer = FakeConsumer(trigger, self.clock)
+        self.collection.addConsumerForTrigger(trigger, consumer)
+        return consumer
+
+    def examinations(self, trigger):
+        return self.collection.examinations.get(trigger, 0)
+
+    def waitFor(self, condition):
+        deadline = time.time() + 10
+
+        while not condition() and time.time() < deadline:
+            time.sleep(0.001)
+
+        return condition()
+
+    # give the Doctor a few rounds in which nothing should happen
+    def idle(self):
+        time.sleep(0.1)
+
+    def testConsumerIsExaminedOnceItsDeadlinePasses(self):
+        consumer = self.addConsumer('/ns/a')
+
+        self.clock.now += TheDoctor.poll_timeout_seconds - 1
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 0)
+
+        # the consumer has polled since, so it isn't examined again right away
+        consumer.lastPollTime = self.clock.now
+        self.clock.now += 1
+        self.assertTrue(self.waitFor(lambda: self.examinations('/ns/a') == 1))
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 1)
+
+    def testOnlyTheLatestDeadlineIsCurrent(self):
+        consumer = self.addConsumer('/ns/a')
+
+        self.clock.now += 10
+        self.doctor.watch('/ns/a')
+
+        self.clock.now += TheDoctor.poll_timeout_seconds - 10
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 0)
+
+        consumer.lastPollTime = self.clock.now
+        self.clock.now += 10
+        self.assertTrue(self.waitFor(lambda: self.examinations('/ns/a') == 1))
+
+    def testHealthyConsumerIsRescheduledFromItsLastPoll(self):
+        consumer = self.addConsumer('/ns/a')
+
+        consumer.lastPollTime = self.clock.now + TheDoctor.poll_timeout_seconds - 50
+        self.clock.now += TheDoctor.poll_timeout_seconds
+        self.assertTrue(self.waitFor(lambda: self.examinations('/ns/a') == 1))
+
+        self.clock.now += TheDoctor.poll_timeout_seconds - 51
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 1)
+
+        consumer.lastPollTime = self.clock.now
+        self.clock.now += 1
+        self.assertTrue(self.waitFor(lambda: self.examinations('/ns/a') == 2))
+        self.assertEqual(consumer.restarts, 0)
+
+    def testTimedOutConsumerIsRestarted(self):
+        consumer = self.addConsumer('/ns/a')
+
+        self.clock.now += TheDoctor.poll_timeout_seconds + 1
+
+        self.assertTrue(self.waitFor(lambda: consumer.restarts == 1))
+
+    def testExitedConsumerIsExaminedRightAway(self):
+        consumer = self.addConsumer('/ns/a')
+        consumer.current = Consumer.State.Dead
+
+        consumerExits.put('/ns/a')
+
+        self.assertTrue(self.waitFor(lambda: consumer.restarts == 1))
+
+    def testDeadConsumerIsRemoved(self):
+        consumer = self.addConsumer('/ns/a')
+        consumer.current = Consumer.State.Dead
+        consumer.desired = Consumer.State.Dead
+
+        consumerExits.put('/ns/a')
+
+        self.assertTrue(self.waitFor(lambda: not self.collection.hasConsumerForTrigger('/ns/a')))
+        self.assertEqual(consumer.restarts, 0)
+
+        # and is no longer watched
+        self.clock.now += TheDoctor.poll_timeout_seconds
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 1)
+
+    def testRemovedConsumerIsForgotten(self):
+        self.addConsumer('/ns/a')
+        self.collection.removeConsumerForTrigger('/ns/a')
+
+        consumerExits.put('/ns/a')
+        self.assertTrue(self.waitFor(lambda: self.examinations('/ns/a') == 1))
+
+        self.clock.now += TheDoctor.poll_timeout_seconds
+        self.idle()
+        self.assertEqual(self.examinations('/ns/a'), 1)
+
+    def testStopEndsTheDoctorAndTheRestarter(self):
+        self.doctor.stop()
+        self.doctor.join(10)
+
+        self.assertFalse(self.doctor.is_alive())
+
+        for thread in self.doctor.restarter.threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
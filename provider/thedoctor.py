@@ -18,19 +18,29 @@
  */
 """
 
+import heapq
 import logging
+import os
 import time
 
-from consumer import Consumer
-from threading import Thread
+from consumer import Consumer, consumerExits
+from consumerrestarter import ConsumerRestarter
+from Queue import Empty
+from threading import Lock, Thread
 
 
+# Rather than examining every consumer on each round, the Doctor keeps a heap
+# of the time at which each consumer's poll timeout could next expire, and only
+# examines the consumers that are due. Consumers that stop are examined as soon
+# as they report their exit through consumerExits. The work done by the Doctor
+# is therefore proportional to what actually happens, not to the number of
+# consumers.
 class TheDoctor (Thread):
     # maximum time to allow a consumer to not successfully poll() before restarting
     # this value must be greater than the total amount of time a consumer might retry firing a trigger
     poll_timeout_seconds = 200
 
-    # interval between the Doctor making rounds
+    # the longest the Doctor will wait for an exit before checking for deadlines
     sleepy_time_seconds = 2
 
     def __init__(self, consumerCollection):
@@ -39,39 +49,133 @@ class TheDoctor (Thread):
         self.daemon = True
         self.consumerCollection = consumerCollection
 
+        # (deadline, triggerFQN) entries. Only the entry matching the deadline
+        # recorded in self.deadlines is current; any others are skipped.
+        self.heap = []
+        self.deadlines = dict()
+        self.lock = Lock()
+        self.stopped = False
+
+        self.restarter = ConsumerRestarter(consumerCollection, int(os.getenv('RESTART_WORKERS', 4)), float(os.getenv('MAX_RESTARTS_PER_SECOND', 2)))
+
+        consumerCollection.addListener(self.watch)
+        for triggerFQN in consumerCollection.getCopyForRead():
+            self.watch(triggerFQN)
+
+    # start keeping an eye on the consumer for this trigger
+    def watch(self, triggerFQN):
+        self.__schedule(triggerFQN, time.time() + self.poll_timeout_seconds)
+
+    # stop examining consumers, and restarting them
+    def stop(self):
+        self.stopped = True
+        self.restarter.stop()
+
     def run(self):
         logging.info('[Doctor] The Doctor is in!')
 
-        while True:
+        while not self.stopped:
             try:
-                consumers = self.consumerCollection.getCopyForRead()
-
-                for consumerId in consumers:
-                    consumer = consumers[consumerId]
-                    logging.debug('[Doctor] [{}] Consumer is in state: {}'.format(consumerId, consumer.currentState()))
-
-                    if consumer.currentState() == Consumer.State.Dead and consumer.desiredState() == Consumer.State.Running:
-                        # well this is unexpected...
-                        logging.error('[Doctor][{}] Consumer is dead, but should be alive!'.format(consumerId))
-                        consumer.restart()
-                    elif consumer.currentState() == Consumer.State.Dead and consumer.desiredState() == Consumer.State.Dead:
-                        # Bring out yer dead...
-                        if consumer.process.is_alive():
-                            logging.info('[{}] Joining dead process.'.format(consumer.trigger))
-                            # if you don't first join the process, it'll be left hanging around as a "defunct" process
-                            consumer.process.join(1)
-                        else:
-                            logging.info('[{}] Process is already dead.'.format(consumer.trigger))
-
-                        logging.info('[{}] Removing dead consumer from the collection.'.format(consumer.trigger))
-                        self.consumerCollection.removeConsumerForTrigger(consumer.trigger)
-                    elif consumer.secondsSinceLastPoll() > self.poll_timeout_seconds and consumer.desiredState() == Consumer.State.Running:
-                        # there seems to be an issue with the kafka-python client where it gets into an
-                        # error-handling loop. This causes poll() to never complete, but also does not
-                        # throw an exception.
-                        logging.error('[Doctor][{}] Consumer timed-out, but should be alive! Restarting consumer.'.format(consumerId))
-                        consumer.restart()
-
-                time.sleep(self.sleepy_time_seconds)
+                try:
+                    triggerFQN = consumerExits.get(timeout=self.__secondsUntilNextDeadline())
+                    logging.debug('[Doctor] [{}] Consumer has exited'.format(triggerFQN))
+                    self.__examine(triggerFQN)
+                except Empty:
+                    pass
+
+                for triggerFQN in self.__due():
+                    self.__examine(triggerFQN)
+
+                self.consumerCollection.releaseStoppedConsumers()
+                self.__checkSpawner()
             except Exception as e:
                 logging.error("[Doctor] Uncaught exception: {}".format(e))
+
+    # The spawner cannot be replaced once the main process has loaded everything
+    # else, and without it no consumer can be started or reaped. Should it die,
+    # stop the consumers it forked and exit, so that the provider is restarted.
+    def __checkSpawner(self):
+        if Consumer.spawner is None or Consumer.spawner.is_alive():
+            return
+
+        logging.error('[Doctor] The consumer spawner has died with exit code {}. Stopping its consumers and exiting.'.format(Consumer.spawner.exitcode))
+
+        consumers = self.consumerCollection.getCopyForRead()
+        for triggerFQN in consumers:
+            consumers[triggerFQN].terminateProcess()
+
+        os._exit(1)
+
+    def __schedule(self, triggerFQN, deadline):
+        with self.lock:
+            self.deadlines[triggerFQN] = deadline
+            heapq.heappush(self.heap, (deadline, triggerFQN))
+
+    def __secondsUntilNextDeadline(self):
+        with self.lock:
+            if len(self.heap) == 0:
+                return self.sleepy_time_seconds
+
+            return min(max(self.heap[0][0] - time.time(), 0), self.sleepy_time_seconds)
+
+    # remove and return the triggers whose deadline has passed
+    def __due(self):
+        now = time.time()
+        due = []
+
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                deadline, triggerFQN = heapq.heappop(self.heap)
+
+                if self.deadlines.get(triggerFQN) == deadline:
+                    del self.deadlines[triggerFQN]
+                    due.append(triggerFQN)
+
+        return due
+
+    def __examine(self, triggerFQN):
+        consumer = self.consumerCollection.getConsumerForTrigger(triggerFQN)
+
+        if consumer is None:
+            with self.lock:
+                self.deadlines.pop(triggerFQN, None)
+            return
+
+        logging.debug('[Doctor] [{}] Consumer is in state: {}'.format(triggerFQN, consumer.currentState()))
+
+        if consumer.currentState() == Consumer.State.Dead and consumer.desiredState() == Consumer.State.Running:
+            # well this is unexpected...
+            logging.error('[Doctor][{}] Consumer is dead, but should be alive!'.format(triggerFQN))
+            self.restarter.schedule(consumer)
+        elif consumer.currentState() == Consumer.State.Dead and consumer.desiredState() == Consumer.State.Dead:
+            # Bring out yer dead...
+            if consumer.isProcessAlive():
+                logging.info('[{}] Joining dead process.'.format(consumer.trigger))
+                # if you don't first join the process, it'll be left hanging around as a "defunct" process
+                consumer.joinProcess(1)
+            else:
+                logging.info('[{}] Process is already dead.'.format(consumer.trigger))
+
+            logging.info('[{}] Removing dead consumer from the collection.'.format(consumer.trigger))
+            self.consumerCollection.removeConsumerForTrigger(consumer.trigger)
+
+            with self.lock:
+                self.deadlines.pop(triggerFQN, None)
+            return
+        elif consumer.secondsSinceLastPoll() > self.poll_timeout_seconds and consumer.desiredState() == Consumer.State.Running:
+            # there seems to be an issue with the kafka-python client where it gets into an
+            # error-handling loop. This causes poll() to never complete, but also does not
+            # throw an exception.
+            logging.error('[Doctor][{}] Consumer timed-out, but should be alive! Restarting consumer.'.format(triggerFQN))
+            self.restarter.schedule(consumer)
+
+        self.__schedule(triggerFQN, self.__nextDeadline(consumer))
+
+    # the earliest time at which the consumer's poll timeout could expire
+    def __nextDeadline(self, consumer):
+        secondsSinceLastPoll = consumer.secondsSinceLastPoll()
+
+        if consumer.desiredState() == Consumer.State.Running and 0 <= secondsSinceLastPoll <= self.poll_timeout_seconds:
+            return time.time() + self.poll_timeout_seconds - secondsSinceLastPoll
+        else:
+            return time.time() + self.poll_timeout_seconds
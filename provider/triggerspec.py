@@ -0,0 +1,67 @@
+"""TriggerSpec class.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+
+# The parts of a trigger document that the provider uses, parsed once when the
+# document is read from the database. Consumers keep one of these rather than
+# the whole document, and hand it to their ConsumerRunner when they start.
+class TriggerSpec(object):
+    __slots__ = ['trigger', 'uuid', 'active', 'triggerURL', 'authKey', 'isIamKey', 'iamUrl',
+                 'isMessageHub', 'brokers', 'topic', 'username', 'password',
+                 'isJSONData', 'isBinaryValue', 'isBinaryKey', 'isParallelPartitions']
+
+    def __init__(self, document):
+        self.__set('trigger', document['_id'])
+        self.__set('uuid', document['uuid'])
+        self.__set('active', 'status' not in document or document['status']['active'] == True)
+
+        self.__set('triggerURL', document['triggerURL'])
+        self.__set('authKey', document.get('authKey'))
+        self.__set('isIamKey', document.get('isIamKey') == True)
+        self.__set('iamUrl', document.get('iamUrl'))
+
+        isMessageHub = document['isMessageHub']
+        self.__set('isMessageHub', isMessageHub)
+        self.__set('brokers', tuple(document['brokers']))
+        self.__set('topic', document['topic'])
+
+        # the SASL credentials for Message Hub
+        self.__set('username', document['username'] if isMessageHub else None)
+        self.__set('password', document['password'] if isMessageHub else None)
+
+        # existing triggers may not have these fields set
+        self.__set('isJSONData', document.get('isJSONData', False))
+        self.__set('isBinaryValue', document.get('isBinaryValue', False))
+        self.__set('isBinaryKey', document.get('isBinaryKey', False))
+        self.__set('isParallelPartitions', document.get('isParallelPartitions') == True)
+
+    def __set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TriggerSpec is immutable')
+
+    # specs are pickled when handed to a ConsumerPool worker or the ConsumerSpawner
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            self.__set(name, value)
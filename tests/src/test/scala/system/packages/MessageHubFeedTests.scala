@@ -328,7 +328,7 @@ class MessageHubFeedTests
       }
   }
 
-  it should "correctly update isJSONData, isBinaryValue, and isBinaryKey" in withAssetCleaner(wskprops) {
+  it should "correctly update isJSONData, isBinaryValue, isBinaryKey, and isParallelPartitions" in withAssetCleaner(wskprops) {
     val currentTime = s"${System.currentTimeMillis}"
 
     (wp, assetHelper) =>
@@ -347,7 +347,8 @@ class MessageHubFeedTests
         "topic" -> topic.toJson,
         "isJSONData" -> true.toJson,
         "isBinaryKey" -> false.toJson,
-        "isBinaryValue" -> false.toJson
+        "isBinaryValue" -> false.toJson,
+        "isParallelPartitions" -> false.toJson
       ))
 
       val readRunResult = wsk.action.invoke(actionName, parameters = Map(
@@ -366,6 +367,7 @@ class MessageHubFeedTests
               config should contain("isBinaryKey" -> false.toJson)
               config should contain("isBinaryValue" -> false.toJson)
               config should contain("isJSONData" -> true.toJson)
+              config should contain("isParallelPartitions" -> false.toJson)
           }
       }
 
@@ -377,7 +379,8 @@ class MessageHubFeedTests
         "authKey" -> wp.authKey.toJson,
         "isBinaryValue" -> true.toJson,
         "isBinaryKey" -> true.toJson,
-        "isJSONData" -> false.toJson
+        "isJSONData" -> false.toJson,
+        "isParallelPartitions" -> true.toJson
       ))
 
       withActivation(wsk.activation, updateRunResult) {
@@ -403,6 +406,7 @@ class MessageHubFeedTests
               config should contain("isBinaryKey" -> true.toJson)
               config should contain("isBinaryValue" -> true.toJson)
               config should contain("isJSONData" -> false.toJson)
+              config should contain("isParallelPartitions" -> true.toJson)
           }
       }
 
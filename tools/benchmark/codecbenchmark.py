@@ -0,0 +1,205 @@
+"""Microbenchmark of the message codecs.
+
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+Compares the codecs in provider/messagecodec.py with the per-message encoding
+that ConsumerRunner used before them, which is reproduced below as the
+baseline. Run with the provider's Python 2 interpreter:
+
+    python tools/benchmark/codecbenchmark.py [messages per batch] [repeats]
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'provider'))
+
+from messagecodec import newMessageCodec
+
+
+class Message:
+    def __init__(self, value, key, offset):
+        self.__value = value
+        self.__key = key
+        self.__offset = offset
+
+    def error(self):
+        return None
+
+    def value(self):
+        return self.__value
+
+    def key(self):
+        return self.__key
+
+    def topic(self):
+        return 'benchmark'
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self.__offset
+
+
+class Spec:
+    def __init__(self, isJSONData=False, isBinaryValue=False, isBinaryKey=False):
+        self.isJSONData = isJSONData
+        self.isBinaryValue = isBinaryValue
+        self.isBinaryKey = isBinaryKey
+
+
+# The encoding done by ConsumerRunner before the codecs were introduced
+class BaselineEncoder:
+    def __init__(self, spec):
+        self.trigger = '/benchmark/trigger'
+        self.encodeValueAsJSON = spec.isJSONData
+        self.encodeValueAsBase64 = spec.isBinaryValue
+        self.encodeKeyAsBase64 = spec.isBinaryKey
+
+    def encodeBatch(self, messages):
+        return [json.dumps(self.getMessagePayload(message)) for message in messages]
+
+    def getMessagePayload(self, message):
+        return {
+            'value': self.encodeMessageIfNeeded(message.value()),
+            'topic': message.topic(),
+            'partition': message.partition(),
+            'offset': message.offset(),
+            'key': self.encodeKeyIfNeeded(message.key())
+        }
+
+    def getUTF8Encoding(self, value):
+        try:
+            value.decode('utf-8')
+        except UnicodeDecodeError:
+            try:
+                logging.debug('[{}] Value is not UTF-8 encoded. Attempting encoding...'.format(self.trigger))
+                value = value.encode('utf-8')
+            except UnicodeDecodeError:
+                logging.debug('[{}] Value contains non-unicode bytes. Replacing invalid bytes.'.format(self.trigger))
+                value = unicode(value, errors='replace').encode('utf-8')
+        except AttributeError:
+            logging.debug('[{}] Cannot decode a NoneType message value'.format(self.trigger))
+
+        return value
+
+    def encodeMessageIfNeeded(self, value):
+        value = self.getUTF8Encoding(value)
+
+        if self.encodeValueAsJSON:
+            try:
+                parsed = json.loads(value, parse_constant=self.errorOnJSONConstant, parse_float=self.parseFloat)
+                logging.debug('[{}] Successfully encoded a message as JSON.'.format(self.trigger))
+                return parsed
+            except ValueError as e:
+                logging.debug('[{}] I was asked to encode a message as JSON, but I failed with "{}".'.format(self.trigger, e))
+                value = "\"{}\"".format(value)
+                return value
+        elif self.encodeValueAsBase64:
+            try:
+                parsed = value.encode("base64").strip()
+                logging.debug('[{}] Successfully encoded a binary message.'.format(self.trigger))
+                return parsed
+            except:
+                logging.debug('[{}] Unable to encode a binary message.'.format(self.trigger))
+                pass
+
+        logging.debug('[{}] Returning un-encoded message'.format(self.trigger))
+        return value
+
+    def encodeKeyIfNeeded(self, key):
+        if self.encodeKeyAsBase64:
+            try:
+                parsed = key.encode("base64").strip()
+                logging.debug('[{}] Successfully encoded a binary key.'.format(self.trigger))
+                return parsed
+            except:
+                logging.debug('[{}] Unable to encode a binary key.'.format(self.trigger))
+                pass
+
+        key = self.getUTF8Encoding(key)
+
+        logging.debug('[{}] Returning un-encoded message'.format(self.trigger))
+        return key
+
+    def errorOnJSONConstant(self, data):
+        raise(ValueError('Constant "{}" detected in JSON.'.format(data)))
+
+    def parseFloat(self, data):
+        res = float(data)
+
+        if res == float('inf'):
+            raise(ValueError('Parsing float value "{}" would result in "Infinity".'.format(data)))
+
+        if res == float('-inf'):
+            raise(ValueError('Parsing float value "{}" would result in "-Infinity".'.format(data)))
+
+        return res
+
+
+def textMessages(count, size):
+    return [Message('x' * size, 'key-{}'.format(i), i) for i in range(count)]
+
+
+def jsonMessages(count, size):
+    return [Message(json.dumps({'id': i, 'score': 1.5, 'text': 'x' * size}), 'key-{}'.format(i), i) for i in range(count)]
+
+
+def structuredMessages(count, fields):
+    return [Message(json.dumps(dict(('field{}'.format(f), {'id': f, 'tags': ['a', 'b'], 'ok': True}) for f in range(fields))), 'key-{}'.format(i), i) for i in range(count)]
+
+
+def binaryMessages(count, size):
+    return [Message(os.urandom(size), os.urandom(16), i) for i in range(count)]
+
+
+def bench(name, spec, messages, repeats):
+    results = []
+
+    for label, codec in [('baseline', BaselineEncoder(spec)), ('codec', newMessageCodec(spec))]:
+        seconds = min(timeit.repeat(lambda: codec.encodeBatch(messages), number=1, repeat=repeats))
+        results.append((label, len(messages) / seconds))
+
+    baseline, codec = results[0][1], results[1][1]
+    print('{:<28} baseline {:>10,.0f} msg/s   codec {:>10,.0f} msg/s   speedup {:.2f}x'.format(name, baseline, codec, codec / baseline))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # debug logging is off in production, as it is here
+    logging.getLogger().setLevel(logging.INFO)
+    random.seed(0)
+
+    bench('raw, 100 byte values', Spec(), textMessages(count, 100), repeats)
+    bench('raw, 10 KB values', Spec(), textMessages(count, 10000), repeats)
+    bench('JSON, 100 byte values', Spec(isJSONData=True), jsonMessages(count, 100), repeats)
+    bench('JSON, 10 KB values', Spec(isJSONData=True), jsonMessages(count, 10000), repeats)
+    bench('JSON, 100 nested objects', Spec(isJSONData=True), structuredMessages(count, 100), repeats)
+    bench('base64, 100 byte values', Spec(isBinaryValue=True, isBinaryKey=True), binaryMessages(count, 100), repeats)
+    bench('base64, 10 KB values', Spec(isBinaryValue=True, isBinaryKey=True), binaryMessages(count, 10000), repeats)
+
+
+if __name__ == '__main__':
+    main()